@@ -1,14 +1,24 @@
 import os
+import re
 import json
+import math
+import hashlib
 import sqlite3
+import orjson
+import time
+import queue
+import atexit
+import threading
 import click
-from flask import Flask, request, jsonify, render_template, send_from_directory, g
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, g, stream_with_context
 from flask_cors import CORS
-from datetime import datetime, timedelta
-import unidecode
+from datetime import datetime, timezone
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.middleware.proxy_fix import ProxyFix
-import traceback
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Any
 
 # =============================================================================
 # КОНФИГУРАЦИЯ И КОНСТАНТЫ
@@ -18,6 +28,7 @@ from typing import Dict, List, Optional, Tuple, Any
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RESULTS_DIR = os.path.join(BASE_DIR, 'results_data')
 DATABASE_PATH = os.path.join(BASE_DIR, 'app_data.db')
+EVENTS_DATABASE_PATH = os.path.join(BASE_DIR, 'events.db')
 SSL_CERT_PATH = os.path.join(BASE_DIR, 'fz152.crt')
 SSL_KEY_PATH = os.path.join(BASE_DIR, 'fz152.key')
 
@@ -44,17 +55,135 @@ TEST_TO_STUDY_PAGE_MAP = {
 # Пороги для успешного прохождения теста
 PASSING_SCORE_THRESHOLD = 80
 
+# Количество номеров документов, резервируемых за одну транзакцию записи
+DOCUMENT_NUMBER_BLOCK_SIZE = 16
+
 # Максимальное время поиска связанной учебной сессии (в часах)
 MAX_STUDY_SESSION_LOOKUP_HOURS = 24
 
+# Перевод ISO-времени в миллисекунды Unix средствами SQLite; строки без
+# часового пояса считаются UTC, нераспознанные значения дают NULL
+EPOCH_MS_SQL = "CAST(ROUND((julianday({}) - 2440587.5) * 86400000) AS INTEGER)"
+
+# Вычисляемый столбец с полем details; некорректный JSON дает NULL вместо ошибки
+EVENT_DETAILS_COLUMN_SQL = (
+    "TEXT GENERATED ALWAYS AS "
+    "(json_extract(CASE WHEN json_valid(details) THEN details END, '{}')) VIRTUAL"
+)
+
+# Настройки каждого нового соединения SQLite: WAL, ожидание блокировки,
+# облегченный fsync, кэш страниц 20 МБ, временные таблицы в памяти и mmap
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA busy_timeout=5000;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA cache_size=-20000;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=268435456;"
+)
+# Те же настройки для events.db, подключенной как схема ev
+SQLITE_EVENTS_PRAGMAS = (
+    "PRAGMA ev.journal_mode=WAL;"
+    "PRAGMA ev.synchronous=NORMAL;"
+    "PRAGMA ev.cache_size=-20000;"
+    "PRAGMA ev.mmap_size=268435456;"
+)
+
+# Предельный размер тела запроса: общий (сохранение результатов теста)
+# и для событий прокторинга, которые отправляются по одному
+MAX_SAVE_RESULTS_SIZE = 10 * 1024 * 1024
+MAX_LOG_EVENT_SIZE = 1024 * 1024
+
+# Срок кэширования статических файлов браузером (в секундах)
+STATIC_FILES_MAX_AGE = 7 * 24 * 60 * 60
+
+# Размер кэша подготовленных выражений на соединение: долгоживущие соединения
+# пула переиспользуют разобранные INSERT/SELECT вместо повторного prepare
+SQLITE_CACHED_STATEMENTS = 256
+
+# Размер пула соединений SQLite для чтения (запись идет через одно соединение)
+DB_READER_POOL_SIZE = int(os.environ.get('DB_READER_POOL_SIZE', os.cpu_count() or 4))
+
+# Число потоков для параллельного чтения JSON-файлов результатов
+JSON_LOAD_WORKERS = int(os.environ.get('JSON_LOAD_WORKERS', 8))
+
+# Пакетная запись событий прокторинга: сброс буфера по размеру или по времени
+EVENT_FLUSH_BATCH_SIZE = 500
+EVENT_FLUSH_INTERVAL_SEC = 0.25
+# Предел буфера событий: при переполнении log_event отвечает 503
+EVENT_BUFFER_MAX_SIZE = 20000
+
+# Кэш результатов аналитики в памяти процесса: время жизни и предельный размер
+ENGAGEMENT_CACHE_TIMEOUT = 600
+STUDY_SESSION_CACHE_TIMEOUT = 3600
+CERTIFICATES_CACHE_TIMEOUT = 360
+EVENTS_CACHE_TIMEOUT = 300
+ABANDONED_SESSIONS_CACHE_TIMEOUT = 30
+MEMO_CACHE_MAX_SIZE = 4096
+
 # =============================================================================
 # ИНИЦИАЛИЗАЦИЯ ПРИЛОЖЕНИЯ
 # =============================================================================
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_FILES_MAX_AGE
+app.config['MAX_CONTENT_LENGTH'] = MAX_SAVE_RESULTS_SIZE
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 CORS(app)
 
+
+def request_too_large_response() -> Tuple[Response, int]:
+    """
+    Формирует ответ 413 для запроса с телом больше допустимого.
+    
+    Returns:
+        Tuple[Response, int]: JSON с ошибкой и код 413
+    """
+    app.logger.warning(
+        f"Отклонен запрос {request.path} от {request.remote_addr}: "
+        f"размер тела больше допустимого ({request.content_length or 'без Content-Length'})"
+    )
+    return jsonify({"status": "error", "message": "Request entity too large"}), 413
+
+
+def read_request_body(limit: int) -> bytes:
+    """
+    Читает тело запроса размером не больше limit байт.
+    
+    Тело без Content-Length (chunked) Werkzeug молча обрезает на
+    MAX_CONTENT_LENGTH, поэтому превышение определяется по оставшимся
+    в исходном потоке данным.
+    
+    Args:
+        limit: Предельный размер тела в байтах (не больше MAX_CONTENT_LENGTH)
+        
+    Returns:
+        bytes: Тело запроса
+        
+    Raises:
+        RequestEntityTooLarge: Тело больше limit байт
+    """
+    body = request.stream.read(limit + 1)
+    if len(body) > limit:
+        raise RequestEntityTooLarge()
+    if (len(body) == app.config['MAX_CONTENT_LENGTH'] and request.content_length is None
+            and 'wsgi.input_terminated' in request.environ
+            and request.environ['wsgi.input'].read(1)):
+        raise RequestEntityTooLarge()
+    return body
+
+
+@app.before_request
+def limit_request_size():
+    """
+    Отклоняет запросы с заявленным телом больше допустимого до его чтения.
+    Тела без Content-Length проверяются при чтении в обработчиках.
+    """
+    limit = MAX_LOG_EVENT_SIZE if request.endpoint == 'log_event' else app.config['MAX_CONTENT_LENGTH']
+    if request.content_length is not None and request.content_length > limit:
+        return request_too_large_response()
+
+
 # Создание необходимых директорий
 if not os.path.exists(RESULTS_DIR):
     os.makedirs(RESULTS_DIR)
@@ -63,38 +192,345 @@ if not os.path.exists(RESULTS_DIR):
 # РАБОТА С БАЗОЙ ДАННЫХ
 # =============================================================================
 
+def open_db_connection(read_only: bool = False, attach_events: bool = True) -> sqlite3.Connection:
+    """
+    Открывает новое соединение с БД SQLite, применяет к нему SQLITE_PRAGMAS
+    и подключает events.db как схему ev.
+    
+    События прокторинга вынесены в отдельный файл, чтобы их поток записи
+    не конкурировал за блокировку и WAL с результатами и сертификатами.
+    
+    Args:
+        read_only: Запретить запись через это соединение (PRAGMA query_only)
+        attach_events: Подключить events.db
+        
+    Returns:
+        sqlite3.Connection: Настроенное соединение с базой данных
+    """
+    db = sqlite3.connect(
+        DATABASE_PATH, check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS
+    )
+    db.row_factory = sqlite3.Row
+    db.executescript(SQLITE_PRAGMAS)
+    if attach_events:
+        db.execute("ATTACH DATABASE ? AS ev", (EVENTS_DATABASE_PATH,))
+        db.executescript(SQLITE_EVENTS_PRAGMAS)
+    if read_only:
+        db.execute("PRAGMA query_only=ON")
+    return db
+
+
+# Пул соединений для чтения и по одному соединению для записи в каждую БД
+_reader_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=DB_READER_POOL_SIZE)
+_writer_connections: Dict[str, sqlite3.Connection] = {}
+_writer_locks = {'main': threading.Lock(), 'ev': threading.Lock()}
+
+
 def get_db_connection() -> sqlite3.Connection:
     """
-    Устанавливает соединение с БД SQLite, используя контекст приложения Flask.
-    Предотвращает ошибки 'database is locked'.
+    Выдает соединение для чтения из пула, закрепляя его за контекстом приложения Flask.
+    Запись выполняется только через get_db_writer().
     
     Returns:
         sqlite3.Connection: Объект соединения с базой данных
     """
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE_PATH)
-        db.row_factory = sqlite3.Row
+        try:
+            db = _reader_pool.get_nowait()
+        except queue.Empty:
+            db = open_db_connection(read_only=True)
+        g._database = db
     return db
 
 
 @app.teardown_appcontext
 def teardown_db(exception):
-    """Закрывает соединение с БД после завершения запроса."""
-    db = getattr(g, '_database', None)
+    """Возвращает соединение для чтения в пул после завершения запроса."""
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        if db.in_transaction:
+            db.rollback()
+        try:
+            _reader_pool.put_nowait(db)
+        except queue.Full:
+            db.close()
 
 
-def init_db():
+@contextmanager
+def get_db_writer(schema: str = 'main') -> Iterator[sqlite3.Connection]:
     """
-    Инициализирует таблицы базы данных и создает индексы для оптимизации производительности.
+    Выдает соединение для записи в указанную БД внутри транзакции.
+    Транзакция фиксируется при выходе из блока и откатывается при исключении.
+    
+    BEGIN IMMEDIATE резервирует на запись все подключенные к соединению файлы,
+    поэтому соединение для app_data.db открывается без events.db. Соединению
+    для событий (schema='ev') app_data.db доступна как схема main, и его
+    транзакции начинаются с BEGIN DEFERRED: блокируются только файлы, в которые
+    выполняется запись.
+    
+    Args:
+        schema: 'main' для app_data.db или 'ev' для events.db
+    
+    Yields:
+        sqlite3.Connection: Соединение с открытой транзакцией записи
     """
-    with app.app_context():
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    with _writer_locks[schema]:
+        conn = _writer_connections.get(schema)
+        if conn is None:
+            conn = _writer_connections[schema] = open_db_connection(attach_events=(schema == 'ev'))
+        conn.execute("BEGIN IMMEDIATE" if schema == 'main' else "BEGIN DEFERRED")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def close_db_connections() -> None:
+    """Закрывает все соединения пула и соединения для записи."""
+    while True:
+        try:
+            _reader_pool.get_nowait().close()
+        except queue.Empty:
+            break
+    for schema, lock in _writer_locks.items():
+        with lock:
+            conn = _writer_connections.pop(schema, None)
+            if conn is not None:
+                # Обновляет статистику планировщика для таблиц, которые
+                # заметно изменились за время работы процесса
+                try:
+                    conn.execute("PRAGMA optimize")
+                except sqlite3.Error as e:
+                    app.logger.warning(f"Не удалось выполнить PRAGMA optimize: {e}")
+                conn.close()
+
+
+atexit.register(close_db_connections)
+
+
+def add_missing_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str],
+                        schema: str = 'main') -> List[str]:
+    """
+    Добавляет в существующую таблицу отсутствующие столбцы.
+    
+    Args:
+        cursor: Курсор соединения для записи
+        table: Имя таблицы
+        columns: Соответствие имени столбца и его объявления
+        schema: Схема БД, в которой находится таблица
         
+    Returns:
+        List[str]: Имена добавленных столбцов
+    """
+    existing_columns = {row[1] for row in cursor.execute(f"PRAGMA {schema}.table_xinfo({table})")}
+    added_columns = []
+    for name, declaration in columns.items():
+        if name not in existing_columns:
+            cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {declaration}")
+            added_columns.append(name)
+    return added_columns
+
+
+def migrate_legacy_events(cursor: sqlite3.Cursor) -> None:
+    """
+    Переносит события прокторинга из app_data.db в events.db.
+    
+    Args:
+        cursor: Курсор соединения для записи
+    """
+    # Миграция БД, созданных до выделения полей details в столбцы
+    added_columns = add_missing_columns(cursor, 'proctoring_events', {
+        'duration_sec': 'REAL',
+        'scroll_depth_pct': 'INTEGER'
+    })
+    if 'duration_sec' in added_columns:
+        cursor.execute('''
+            UPDATE main.proctoring_events SET duration_sec = json_extract(details, '$.duration')
+            WHERE event_type = 'module_view_time' AND json_valid(details)
+            AND json_type(details, '$.duration') IN ('integer', 'real')
+        ''')
+    if 'scroll_depth_pct' in added_columns:
+        # Те же правила, что в build_event_row: целое число от 0 до 100,
+        # возможно со знаком процента; в остальных случаях столбец остается NULL
+        cursor.execute('''
+            UPDATE main.proctoring_events 
+            SET scroll_depth_pct = CAST(REPLACE(json_extract(details, '$.depth'), '%', '') AS INTEGER)
+            WHERE event_type = 'scroll_depth_milestone' AND json_valid(details)
+            AND json_type(details, '$.depth') IN ('integer', 'text')
+            AND REPLACE(json_extract(details, '$.depth'), '%', '') GLOB '[0-9]*'
+            AND REPLACE(json_extract(details, '$.depth'), '%', '') NOT GLOB '*[^0-9]*'
+            AND CAST(REPLACE(json_extract(details, '$.depth'), '%', '') AS INTEGER) <= 100
+        ''')
+    
+    # OR IGNORE: фиксация в двух файлах БД не атомарна, и после сбоя
+    # часть событий может уже находиться в events.db
+    cursor.execute('''
+        INSERT OR IGNORE INTO ev.proctoring_events 
+            (id, session_id, event_type, event_timestamp, details, duration_sec, scroll_depth_pct)
+        SELECT id, session_id, event_type, event_timestamp, details, duration_sec, scroll_depth_pct
+        FROM main.proctoring_events
+    ''')
+    app.logger.info(f"Перенесено событий прокторинга в events.db: {cursor.rowcount}")
+    cursor.execute("DROP TABLE main.proctoring_events")
+
+
+def normalize_naive_event_timestamps(cursor: sqlite3.Cursor) -> int:
+    """
+    Переводит в UTC метки времени событий, записанные без часового пояса.
+    
+    Раньше сервер подставлял в событие без eventTimestamp локальное время
+    без смещения, а event_timestamp_ms считает такие строки временем UTC.
+    Клиенты передают время через Date.toISOString() (с суффиксом Z), поэтому
+    строки без смещения считаются локальным временем сервера.
+    
+    Args:
+        cursor: Курсор соединения для записи в events.db
+        
+    Returns:
+        int: Количество исправленных событий
+    """
+    rows = cursor.execute("""
+        SELECT id, event_timestamp FROM ev.proctoring_events
+        WHERE event_timestamp NOT LIKE '%Z'
+        AND event_timestamp NOT GLOB '*[+-][0-9][0-9]:[0-9][0-9]'
+    """).fetchall()
+    
+    updates = []
+    for event_id, event_timestamp in rows:
         try:
+            # astimezone() для времени без смещения использует часовой пояс процесса
+            utc_timestamp = datetime.fromisoformat(event_timestamp).astimezone(timezone.utc)
+        except ValueError:
+            app.logger.warning(f"Нераспознанная метка времени события {event_id}: {event_timestamp}")
+            continue
+        updates.append((utc_timestamp.isoformat(), event_id))
+    
+    cursor.executemany("UPDATE ev.proctoring_events SET event_timestamp = ? WHERE id = ?", updates)
+    return len(updates)
+
+
+def init_events_schema(cursor: sqlite3.Cursor) -> None:
+    """
+    Создает таблицы, индексы и триггеры events.db и переносит в нее
+    события из app_data.db, если они там остались.
+    
+    Args:
+        cursor: Курсор соединения для записи в events.db
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ev.proctoring_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            event_timestamp TEXT NOT NULL,
+            details TEXT,
+            duration_sec REAL,
+            scroll_depth_pct INTEGER
+        )
+    ''')
+    # Вычисляемые столбцы не хранятся в строках; поля details доступны
+    # индексам без разбора JSON при каждом поиске
+    add_missing_columns(cursor, 'proctoring_events', {
+        'event_timestamp_ms': 'INTEGER GENERATED ALWAYS AS ({}) VIRTUAL'.format(
+            EPOCH_MS_SQL.format('event_timestamp')),
+        'persistent_id': EVENT_DETAILS_COLUMN_SQL.format('$.persistentId'),
+        'client_ip': EVENT_DETAILS_COLUMN_SQL.format('$.ip'),
+        'page': EVENT_DETAILS_COLUMN_SQL.format('$.page'),
+    }, schema='ev')
+    
+    # События прокторинга раньше хранились в app_data.db
+    if cursor.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'proctoring_events'"
+    ).fetchone():
+        migrate_legacy_events(cursor)
+    
+    # Однократная миграция меток времени; номер выполненной миграции
+    # хранится в user_version events.db
+    if cursor.execute("PRAGMA ev.user_version").fetchone()[0] < 1:
+        normalized_count = normalize_naive_event_timestamps(cursor)
+        app.logger.info(f"Переведено в UTC меток времени событий без часового пояса: {normalized_count}")
+        cursor.execute("PRAGMA ev.user_version = 1")
+    
+    # Создание индексов для оптимизации запросов
+    # Выборки событий сессии в хронологическом порядке и MIN/MAX по времени;
+    # event_type в конце делает индекс покрывающим для подсчета нарушений
+    # по сессиям (get_abandoned_session_rows) без чтения строк таблицы
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ev.idx_proctoring_events_session_ts_type 
+        ON proctoring_events(session_id, event_timestamp, event_type)
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS ev.idx_proctoring_events_session_ts")
+    
+    # Поиск учебной сессии по persistent ID или IP (find_related_study_session);
+    # частичные индексы вычисляют поля details только для study_started
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ev.idx_study_started_pid_page_ms 
+        ON proctoring_events(persistent_id, page, event_timestamp_ms)
+        WHERE event_type = 'study_started'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ev.idx_study_started_ip_page_ms 
+        ON proctoring_events(client_ip, page, event_timestamp_ms)
+        WHERE event_type = 'study_started'
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS ev.idx_study_started_id")
+    cursor.execute("DROP INDEX IF EXISTS ev.idx_proctoring_events_type_ms")
+    cursor.execute("DROP INDEX IF EXISTS ev.idx_proctoring_events_type_ts")
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ev.idx_proctoring_events_timestamp 
+        ON proctoring_events(event_timestamp)
+    ''')
+    
+    # Сессии, по которым еще не получен результат: пополняются триггером
+    # при вставке события и очищаются при сохранении результата
+    open_sessions_exists = cursor.execute(
+        "SELECT 1 FROM ev.sqlite_master WHERE type = 'table' AND name = 'open_sessions'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ev.open_sessions (
+            session_id TEXT PRIMARY KEY
+        )
+    ''')
+    # Миграция таблицы с неиспользуемым столбцом first_seen: столбец,
+    # на который ссылается триггер, удалить нельзя
+    if 'first_seen' in {row[1] for row in cursor.execute("PRAGMA ev.table_xinfo(open_sessions)")}:
+        cursor.execute("DROP TRIGGER IF EXISTS ev.trg_proctoring_events_open_session")
+        cursor.execute("ALTER TABLE ev.open_sessions DROP COLUMN first_seen")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ev.trg_proctoring_events_open_session
+        AFTER INSERT ON proctoring_events
+        BEGIN
+            INSERT OR IGNORE INTO open_sessions (session_id) VALUES (NEW.session_id);
+        END
+    ''')
+    if not open_sessions_exists:
+        cursor.execute('''
+            INSERT OR IGNORE INTO ev.open_sessions (session_id)
+            SELECT DISTINCT session_id FROM ev.proctoring_events
+        ''')
+    
+    # Завершенные сессии, которые вернул в open_sessions триггер из-за
+    # событий, записанных уже после результата; до очистки их исключает
+    # фильтр по result_metadata в get_abandoned_session_rows
+    cursor.execute('''
+        DELETE FROM ev.open_sessions WHERE session_id IN (
+            SELECT session_id FROM main.result_metadata WHERE session_id IS NOT NULL
+        )
+    ''')
+
+
+def init_db():
+    """
+    Инициализирует таблицы базы данных и создает индексы для оптимизации производительности.
+    """
+    try:
+        with get_db_writer() as conn:
+            cursor = conn.cursor()
+            
             # Создание таблиц
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS document_counters (
@@ -103,16 +539,6 @@ def init_db():
                 )
             ''')
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS proctoring_events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    event_type TEXT NOT NULL,
-                    event_timestamp TEXT NOT NULL,
-                    details TEXT
-                )
-            ''')
-            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS certificates (
                     document_number TEXT PRIMARY KEY,
@@ -125,34 +551,66 @@ def init_db():
                 )
             ''')
             
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS result_metadata (
+                    filename TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    test_type TEXT,
+                    score_percentage INTEGER,
+                    start_time TEXT,
+                    end_time TEXT,
+                    persistent_id TEXT,
+                    client_ip TEXT,
+                    received_at TEXT NOT NULL
+                )
+            ''')
+            # Длительность теста в секундах для поведенческого анализа
+            add_missing_columns(cursor, 'result_metadata', {
+                'test_duration_sec': 'REAL GENERATED ALWAYS AS '
+                                     '(ROUND((julianday(end_time) - julianday(start_time)) * 86400, 3)) VIRTUAL'
+            })
+            
             # Создание индексов для оптимизации запросов
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_proctoring_events_session_id 
-                ON proctoring_events(session_id)
+                CREATE INDEX IF NOT EXISTS idx_certificates_issue_date 
+                ON certificates(issue_date)
             ''')
             
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_proctoring_events_event_type 
-                ON proctoring_events(event_type)
+                CREATE INDEX IF NOT EXISTS idx_result_metadata_received_at 
+                ON result_metadata(received_at DESC, filename DESC)
             ''')
             
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_proctoring_events_timestamp 
-                ON proctoring_events(event_timestamp)
+                CREATE INDEX IF NOT EXISTS idx_result_metadata_session_id 
+                ON result_metadata(session_id)
             ''')
             
+            # Отбор кандидатов поведенческого анализа: поиск по типу теста
+            # и минимальному баллу вместо просмотра всех результатов; порог
+            # длительности проверяется по индексу до чтения строки таблицы
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_certificates_issue_date 
-                ON certificates(issue_date)
+                CREATE INDEX IF NOT EXISTS idx_result_metadata_type_score_duration 
+                ON result_metadata(test_type, score_percentage, test_duration_sec)
             ''')
+            cursor.execute("DROP INDEX IF EXISTS idx_result_metadata_type_score")
             
-            conn.commit()
-            app.logger.info("База данных успешно инициализирована")
+            # Статистика индексов для планировщика запросов
+            cursor.execute("ANALYZE main")
+        
+        # Индексируем файлы результатов, сохраненные до появления result_metadata;
+        # до создания open_sessions, чтобы завершенные сессии не попали в нее
+        backfill_metadata()
+        
+        with get_db_writer('ev') as conn:
+            init_events_schema(conn.cursor())
+            conn.execute("ANALYZE ev")
             
-        except sqlite3.Error as e:
-            app.logger.error(f"Ошибка при инициализации базы данных: {e}")
-            conn.rollback()
-            raise
+        app.logger.info("База данных успешно инициализирована")
+        
+    except sqlite3.Error as e:
+        app.logger.error(f"Ошибка при инициализации базы данных: {e}")
+        raise
 
 
 @app.cli.command("init-db")
@@ -162,49 +620,88 @@ def init_db_command():
         init_db()
         click.echo("База данных успешно инициализирована.")
     except Exception as e:
-        click.echo(f"Ошибка при инициализации базы данных: {e}")
+        # Ненулевой код возврата останавливает запуск сервиса (ExecStartPre)
+        raise click.ClickException(f"Ошибка при инициализации базы данных: {e}")
+
 
+# Номера документов, зарезервированные процессом, но еще не выданные
+_reserved_document_numbers: deque = deque()
+_reserved_document_period: Optional[str] = None
+_reserved_document_lock = threading.Lock()
 
-def get_next_document_number() -> str:
+
+def reserve_document_numbers(period: str, count: int) -> List[str]:
     """
-    Генерирует следующий номер документа в формате ГГ/ММ-XXXX.
+    Резервирует в БД блок последовательных номеров документов одной транзакцией.
     
-    Returns:
-        str: Уникальный номер документа
+    Args:
+        period: Период в формате ГГ/ММ
+        count: Количество резервируемых номеров
         
-    Raises:
-        sqlite3.Error: При ошибке работы с базой данных
+    Returns:
+        List[str]: Зарезервированные номера в порядке возрастания
     """
-    try:
-        conn = get_db_connection()
+    with get_db_writer() as conn:
         cursor = conn.cursor()
-        
-        now = datetime.now()
-        current_year_short = now.strftime("%y")
-        current_month = now.strftime("%m")
-        current_period = f"{current_year_short}/{current_month}"
-        
         cursor.execute(
             "SELECT last_sequence_number FROM document_counters WHERE period = ?", 
-            (current_period,)
+            (period,)
         )
         row = cursor.fetchone()
         
         if row:
-            next_sequence_number = row['last_sequence_number'] + 1
+            first_sequence_number = row['last_sequence_number'] + 1
             cursor.execute(
                 "UPDATE document_counters SET last_sequence_number = ? WHERE period = ?", 
-                (next_sequence_number, current_period)
+                (first_sequence_number + count - 1, period)
             )
         else:
-            next_sequence_number = 1
+            first_sequence_number = 1
             cursor.execute(
                 "INSERT INTO document_counters (period, last_sequence_number) VALUES (?, ?)",
-                (current_period, next_sequence_number)
+                (period, count)
             )
+    
+    return [
+        f"{period}-{sequence_number:04d}"
+        for sequence_number in range(first_sequence_number, first_sequence_number + count)
+    ]
+
+
+def get_next_document_number(now: Optional[datetime] = None) -> str:
+    """
+    Генерирует следующий номер документа в формате ГГ/ММ-XXXX.
+    Номера резервируются в БД блоками по DOCUMENT_NUMBER_BLOCK_SIZE, поэтому
+    номера, не выданные до перезапуска процесса или смены месяца, пропускаются.
+    
+    Args:
+        now: Момент выдачи номера (по умолчанию - текущее время)
+    
+    Returns:
+        str: Уникальный номер документа
+        
+    Raises:
+        sqlite3.Error: При ошибке работы с базой данных
+    """
+    global _reserved_document_period
+    try:
+        now = now or datetime.now()
+        current_year_short = now.strftime("%y")
+        current_month = now.strftime("%m")
+        current_period = f"{current_year_short}/{current_month}"
+        
+        with _reserved_document_lock:
+            if _reserved_document_period != current_period:
+                _reserved_document_numbers.clear()
+                _reserved_document_period = current_period
+            
+            if not _reserved_document_numbers:
+                _reserved_document_numbers.extend(
+                    reserve_document_numbers(current_period, DOCUMENT_NUMBER_BLOCK_SIZE)
+                )
+            
+            document_number = _reserved_document_numbers.popleft()
         
-        conn.commit()
-        document_number = f"{current_period}-{next_sequence_number:04d}"
         app.logger.info(f"Сгенерирован номер документа: {document_number}")
         return document_number
         
@@ -213,10 +710,268 @@ def get_next_document_number() -> str:
         raise
 
 
+# =============================================================================
+# ПАКЕТНАЯ ЗАПИСЬ СОБЫТИЙ ПРОКТОРИНГА
+# =============================================================================
+
+INSERT_EVENT_SQL = """
+    INSERT INTO ev.proctoring_events (session_id, event_type, event_timestamp, details,
+                                   duration_sec, scroll_depth_pct)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_event_buffer: List[Tuple[Any, ...]] = []
+_event_buffer_lock = threading.Lock()
+_event_buffer_full = threading.Event()
+_event_flush_lock = threading.Lock()
+_event_writer_thread: Optional[threading.Thread] = None
+
+
+def build_event_row(session_id: str, event_type: str, event_timestamp: str, 
+                    details: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    Формирует строку proctoring_events, вынося используемые в аналитике
+    поля details в отдельные столбцы.
+
+    Args:
+        session_id: ID сессии
+        event_type: Тип события
+        event_timestamp: Время события
+        details: Детали события
+
+    Returns:
+        Tuple: Значения параметров INSERT_EVENT_SQL
+    """
+    duration_sec = None
+    scroll_depth_pct = None
+
+    if event_type == 'module_view_time':
+        duration = details.get('duration')
+        if isinstance(duration, (int, float)) and not isinstance(duration, bool):
+            try:
+                duration = float(duration)
+            except OverflowError:
+                duration = math.inf
+            # Значения вне диапазона REAL не записываются в столбец
+            if math.isfinite(duration):
+                duration_sec = duration
+    elif event_type == 'scroll_depth_milestone':
+        depth = details.get('depth')
+        if isinstance(depth, (int, str)) and not isinstance(depth, bool):
+            depth = str(depth).replace('%', '')
+            if depth.isascii() and depth.isdigit() and int(depth) <= 100:
+                scroll_depth_pct = int(depth)
+
+    return (
+        session_id,
+        event_type,
+        event_timestamp,
+        orjson.dumps(details).decode(),
+        duration_sec,
+        scroll_depth_pct
+    )
+
+
+def enqueue_event(event_row: Tuple[Any, ...]) -> bool:
+    """
+    Помещает событие в буфер для последующей пакетной записи в БД.
+
+    Args:
+        event_row: Строка события, сформированная build_event_row
+
+    Returns:
+        bool: False, если буфер переполнен и событие не принято
+    """
+    _ensure_event_writer()
+    with _event_buffer_lock:
+        if len(_event_buffer) >= EVENT_BUFFER_MAX_SIZE:
+            return False
+        _event_buffer.append(event_row)
+        buffer_size = len(_event_buffer)
+
+    if buffer_size >= EVENT_FLUSH_BATCH_SIZE:
+        _event_buffer_full.set()
+    return True
+
+
+def flush_event_buffer() -> int:
+    """
+    Записывает все накопленные события одной транзакцией
+    через соединение для записи, не связанное с контекстом Flask.
+    Сбросы выполняются строго по очереди, поэтому после возврата
+    в БД находятся все события, принятые до вызова.
+
+    Returns:
+        int: Количество записанных событий
+    """
+    with _event_flush_lock:
+        with _event_buffer_lock:
+            batch = _event_buffer[:]
+            _event_buffer.clear()
+
+        if not batch:
+            return 0
+
+        try:
+            with get_db_writer('ev') as conn:
+                conn.executemany(INSERT_EVENT_SQL, batch)
+            return len(batch)
+
+        except sqlite3.OperationalError as e:
+            # БД занята или заблокирована: возвращаем события в начало буфера
+            # для повторной попытки
+            app.logger.error(f"Ошибка при пакетной записи {len(batch)} событий: {e}")
+            with _event_buffer_lock:
+                _event_buffer[:0] = batch
+            return 0
+
+        except Exception as e:
+            # Пакет содержит событие, которое невозможно записать: повторная
+            # попытка завершится той же ошибкой, поэтому события записываются
+            # по одному, а отклоненные отбрасываются
+            app.logger.error(f"Ошибка при пакетной записи {len(batch)} событий, "
+                             f"выполняется запись по одному: {e}")
+            return _insert_events_one_by_one(batch)
+
+
+def _insert_events_one_by_one(batch: List[Tuple[Any, ...]]) -> int:
+    """
+    Записывает события по одному в одной транзакции, отбрасывая те,
+    которые БД не принимает. При временной недоступности БД весь пакет
+    возвращается в буфер.
+
+    Args:
+        batch: Строки событий, сформированные build_event_row
+
+    Returns:
+        int: Количество записанных событий
+    """
+    written = 0
+    try:
+        with get_db_writer('ev') as conn:
+            for event_row in batch:
+                try:
+                    conn.execute(INSERT_EVENT_SQL, event_row)
+                    written += 1
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    app.logger.error(f"Событие отброшено (сессия {event_row[0]!r}, "
+                                     f"тип {event_row[1]!r}): {e}")
+        return written
+
+    except sqlite3.OperationalError as e:
+        app.logger.error(f"Ошибка при записи {len(batch)} событий: {e}")
+        with _event_buffer_lock:
+            _event_buffer[:0] = batch
+        return 0
+
+
+def _event_writer_loop() -> None:
+    """Фоновый цикл, периодически сбрасывающий буфер событий в БД."""
+    while True:
+        _event_buffer_full.wait(EVENT_FLUSH_INTERVAL_SEC)
+        _event_buffer_full.clear()
+        try:
+            flush_event_buffer()
+        except Exception as e:
+            app.logger.error(f"Неожиданная ошибка в потоке записи событий: {e}")
+
+
+def _ensure_event_writer() -> None:
+    """Запускает фоновый поток записи событий, если он еще не запущен."""
+    global _event_writer_thread
+    if _event_writer_thread is not None and _event_writer_thread.is_alive():
+        return
+
+    with _event_buffer_lock:
+        if _event_writer_thread is None or not _event_writer_thread.is_alive():
+            _event_writer_thread = threading.Thread(
+                target=_event_writer_loop, name="proctoring-event-writer", daemon=True
+            )
+            _event_writer_thread.start()
+
+
+# Не теряем накопленные события при остановке процесса
+atexit.register(flush_event_buffer)
+
+
+# =============================================================================
+# КЭШ В ПАМЯТИ ПРОЦЕССА
+# =============================================================================
+# Ключи кэша включают версию исходных данных (например, время последнего
+# события сессии), поэтому устаревшие записи просто перестают запрашиваться
+# и вытесняются по времени жизни.
+
+_memo_cache: Dict[Tuple, Tuple[float, Any]] = {}
+_memo_cache_lock = threading.Lock()
+
+
+def cache_get(key: Tuple) -> Optional[Any]:
+    """
+    Возвращает значение из кэша или None, если его нет или срок истек.
+
+    Args:
+        key: Ключ кэша; первый элемент - пространство имен
+
+    Returns:
+        Optional[Any]: Сохраненное значение
+    """
+    with _memo_cache_lock:
+        entry = _memo_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del _memo_cache[key]
+            return None
+        return value
+
+
+def cache_set(key: Tuple, value: Any, timeout: float) -> None:
+    """
+    Сохраняет значение в кэше на timeout секунд.
+
+    Args:
+        key: Ключ кэша; первый элемент - пространство имен
+        value: Значение (не None)
+        timeout: Время жизни записи в секундах
+    """
+    now = time.monotonic()
+    with _memo_cache_lock:
+        if len(_memo_cache) >= MEMO_CACHE_MAX_SIZE:
+            for stale_key in [k for k, (expires_at, _) in _memo_cache.items() if expires_at < now]:
+                del _memo_cache[stale_key]
+            if len(_memo_cache) >= MEMO_CACHE_MAX_SIZE:
+                _memo_cache.clear()
+        _memo_cache[key] = (now + timeout, value)
+
+
+def conditional_json_response(payload: bytes, cache_key: Tuple) -> Response:
+    """
+    Формирует JSON-ответ с ETag, вычисленным по ключу кэша (версии данных).
+    При совпадении If-None-Match клиенту возвращается 304 без тела.
+
+    Args:
+        payload: Сериализованный JSON
+        cache_key: Ключ кэша, под которым хранится payload
+
+    Returns:
+        Response: Ответ 200 с телом или 304
+    """
+    response = Response(payload, mimetype='application/json')
+    response.set_etag(hashlib.md5(repr(cache_key).encode()).hexdigest())
+    return response.make_conditional(request)
+
+
 # =============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # =============================================================================
 
+# Символы, недопустимые в имени файла после транслитерации
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
 def sanitize_filename(name_part: str) -> str:
     """
     Очищает строку для использования в имени файла.
@@ -231,39 +986,45 @@ def sanitize_filename(name_part: str) -> str:
     if not name_part:
         return "Unknown"
     
-    # Транслитерация в латиницу
-    name_part = unidecode.unidecode(str(name_part))
+    # Транслитерация в латиницу; модуль импортируется только при сохранении результатов
+    from unidecode import unidecode
+    name_part = unidecode(str(name_part))
     # Оставляем только буквы, цифры, подчеркивания и дефисы
-    name_part = "".join(c if c.isalnum() or c in ['_', '-'] else '_' for c in name_part)
+    name_part = _UNSAFE_FILENAME_CHARS.sub('_', name_part)
     return name_part.strip('_') or "Unknown"
 
 
-def validate_json_data(data: Dict[str, Any], required_fields: List[str]) -> Tuple[bool, str]:
+def create_result_file(filename: str, payload: bytes) -> str:
     """
-    Валидирует JSON данные на наличие обязательных полей.
+    Создает новый файл результата, не перезаписывая существующий.
+    При совпадении имени к нему добавляется числовой суффикс.
     
     Args:
-        data: Данные для валидации
-        required_fields: Список обязательных полей
+        filename: Желаемое имя файла
+        payload: Содержимое файла
         
     Returns:
-        Tuple[bool, str]: (True, "") если валидация прошла успешно, 
-                         (False, error_message) в противном случае
+        str: Фактическое имя созданного файла
     """
-    if not data:
-        return False, "Отсутствуют данные"
-    
-    missing_fields = [field for field in required_fields if field not in data]
-    if missing_fields:
-        return False, f"Отсутствуют обязательные поля: {', '.join(missing_fields)}"
-    
-    return True, ""
-
-
-def save_certificate_to_db(document_number: str, user_info: Dict[str, Any], 
-                          test_type: str, score_percentage: int, session_id: str) -> bool:
+    base, extension = os.path.splitext(filename)
+    candidate = filename
+    attempt = 0
+    while True:
+        try:
+            fd = os.open(os.path.join(RESULTS_DIR, candidate), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            attempt += 1
+            candidate = f"{base}_{attempt}{extension}"
+            continue
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        return candidate
+
+
+def build_certificate_row(document_number: str, user_info: Dict[str, Any], test_type: str, 
+                          score_percentage: int, session_id: str, issue_date: str) -> Tuple[Any, ...]:
     """
-    Сохраняет информацию о сертификате в базу данных.
+    Формирует строку таблицы certificates.
     
     Args:
         document_number: Номер документа
@@ -271,74 +1032,284 @@ def save_certificate_to_db(document_number: str, user_info: Dict[str, Any],
         test_type: Тип теста
         score_percentage: Процент правильных ответов
         session_id: ID сессии
+        issue_date: Дата выдачи в формате ISO
         
     Returns:
-        bool: True если сохранение прошло успешно
+        Tuple: Значения столбцов certificates
+    """
+    full_name = " ".join([
+        user_info.get('lastName', ''),
+        user_info.get('firstName', ''),
+        user_info.get('middleName', '')
+    ]).strip()
+    
+    return (
+        document_number,
+        full_name,
+        user_info.get('position', ''),
+        test_type,
+        issue_date,
+        score_percentage,
+        session_id
+    )
+
+
+def load_result_file(filename: str) -> Optional[Dict[str, Any]]:
     """
+    Загружает JSON-файл результата теста из директории результатов.
+    
+    Args:
+        filename: Имя файла результата
+        
+    Returns:
+        Optional[Dict]: Данные теста или None, если файл не удалось прочитать
+    """
+    filepath = os.path.join(RESULTS_DIR, filename)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with open(filepath, 'rb') as f:
+            return orjson.loads(f.read())
+    except (orjson.JSONDecodeError, OSError) as e:
+        app.logger.warning(f"Не удалось загрузить файл {filename}: {e}")
+        return None
+
+
+def read_result_file(filename: str) -> Optional[bytes]:
+    """
+    Читает JSON-файл результата теста без разбора.
+    
+    Args:
+        filename: Имя файла результата
         
-        full_name = " ".join([
-            user_info.get('lastName', ''),
-            user_info.get('firstName', ''),
-            user_info.get('middleName', '')
-        ]).strip()
+    Returns:
+        Optional[bytes]: Содержимое файла или None, если файл не удалось прочитать
+    """
+    filepath = os.path.join(RESULTS_DIR, filename)
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        app.logger.warning(f"Не удалось прочитать файл {filename}: {e}")
+        return None
+
+
+_json_load_pool = ThreadPoolExecutor(max_workers=JSON_LOAD_WORKERS, thread_name_prefix="result-loader")
+
+
+def iter_result_files(filenames: List[str], 
+                      loader: Callable[[str], Any] = load_result_file) -> Iterator[Any]:
+    """
+    Параллельно загружает файлы результатов и выдает их по одному в исходном порядке.
+    В памяти одновременно находится не более 2 * JSON_LOAD_WORKERS файлов.
+    Нечитаемые файлы пропускаются.
+    
+    Args:
+        filenames: Имена файлов результатов
+        loader: Функция чтения файла (load_result_file или read_result_file)
         
-        cursor.execute("""
-            INSERT INTO certificates (document_number, user_fullname, user_position, 
-                                    test_type, issue_date, score_percentage, session_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            document_number,
-            full_name,
-            user_info.get('position', ''),
-            test_type,
-            datetime.now().isoformat(),
-            score_percentage,
-            session_id
-        ))
-        conn.commit()
-        app.logger.info(f"Сертификат {document_number} сохранен в БД для пользователя {full_name}")
+    Yields:
+        Данные успешно загруженного теста в формате, возвращаемом loader
+    """
+    pending = deque()
+    for filename in filenames:
+        pending.append(_json_load_pool.submit(loader, filename))
+        if len(pending) >= 2 * JSON_LOAD_WORKERS:
+            test_data = pending.popleft().result()
+            if test_data is not None:
+                yield test_data
+    
+    while pending:
+        test_data = pending.popleft().result()
+        if test_data is not None:
+            yield test_data
+
+
+def stream_raw_json_array(documents: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Склеивает уже сериализованные JSON-документы в JSON-массив по частям.
+    
+    Args:
+        documents: Корректные JSON-документы
+        
+    Yields:
+        bytes: Очередной фрагмент JSON-массива
+    """
+    yield b'['
+    for index, document in enumerate(documents):
+        if index:
+            yield b','
+        yield document
+    yield b']'
+
+
+RESULT_METADATA_COLUMNS = (
+    "filename, session_id, test_type, score_percentage, start_time, "
+    "end_time, persistent_id, client_ip, received_at"
+)
+
+
+def build_result_metadata_row(filename: str, data: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    Извлекает из результата теста поля, индексируемые в таблице result_metadata.
+    
+    Args:
+        filename: Имя файла результата
+        data: Данные теста
+        
+    Returns:
+        Tuple: Значения столбцов result_metadata в порядке RESULT_METADATA_COLUMNS
+    """
+    def as_dict(value: Any) -> Dict[str, Any]:
+        return value if isinstance(value, dict) else {}
+    
+    def as_scalar(value: Any) -> Any:
+        # Вложенные объекты и списки не сохраняются в столбцы SQLite
+        return value if isinstance(value, (str, int, float)) else None
+    
+    session_metrics = as_dict(data.get('sessionMetrics'))
+    test_results = as_dict(data.get('testResults'))
+    persistent_id = as_dict(data.get('persistentId'))
+    received_at = as_scalar(data.get('serverReceiveTimestamp', data.get('clientSubmitTimestamp', '')))
+    
+    return (
+        filename,
+        as_scalar(data.get('sessionId')),
+        as_scalar(data.get('testType')),
+        as_scalar(test_results.get('percentage')),
+        as_scalar(session_metrics.get('startTime')),
+        as_scalar(session_metrics.get('endTime')),
+        as_scalar(persistent_id.get('cookie')),
+        as_scalar(data.get('clientIp')),
+        str(received_at or '')
+    )
+
+
+def save_result_to_db(filename: str, data: Dict[str, Any], 
+                      certificate_row: Optional[Tuple[Any, ...]] = None) -> bool:
+    """
+    Сохраняет метаданные результата теста и, при наличии, сертификат
+    в одной транзакции.
+    
+    Args:
+        filename: Имя файла результата
+        data: Данные теста
+        certificate_row: Строка сертификата из build_certificate_row
+        
+    Returns:
+        bool: True если сохранение прошло успешно
+    """
+    try:
+        with get_db_writer() as conn:
+            if certificate_row:
+                conn.execute("""
+                    INSERT INTO certificates (document_number, user_fullname, user_position, 
+                                            test_type, issue_date, score_percentage, session_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, certificate_row)
+            conn.execute(
+                f"INSERT INTO result_metadata ({RESULT_METADATA_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(filename) DO UPDATE SET "
+                "session_id = excluded.session_id, test_type = excluded.test_type, "
+                "score_percentage = excluded.score_percentage, start_time = excluded.start_time, "
+                "end_time = excluded.end_time, persistent_id = excluded.persistent_id, "
+                "client_ip = excluded.client_ip, received_at = excluded.received_at",
+                build_result_metadata_row(filename, data)
+            )
+        if certificate_row:
+            app.logger.info(f"Сертификат {certificate_row[0]} сохранен в БД для пользователя {certificate_row[1]}")
         return True
         
     except sqlite3.Error as e:
-        app.logger.error(f"Ошибка при сохранении сертификата в БД: {e}")
+        app.logger.error(f"Ошибка при сохранении результата {filename} в БД: {e}")
         return False
 
 
-def load_completed_tests() -> List[Dict[str, Any]]:
+def close_open_session(session_id: str) -> None:
     """
-    Загружает все завершенные тесты из файловой системы.
+    Удаляет сессию из open_sessions после сохранения ее результата.
     
-    Returns:
-        List[Dict]: Список данных завершенных тестов
+    Args:
+        session_id: ID сессии
     """
-    completed_tests = []
+    try:
+        with get_db_writer('ev') as conn:
+            conn.execute("DELETE FROM ev.open_sessions WHERE session_id = ?", (session_id,))
+    except sqlite3.Error as e:
+        app.logger.error(f"Ошибка при закрытии сессии {session_id}: {e}")
+
+
+def backfill_metadata() -> int:
+    """
+    Добавляет в result_metadata файлы результатов, которых еще нет в таблице.
+    Однократно проходит по директории результатов при инициализации БД.
     
+    Returns:
+        int: Количество добавленных записей
+    """
     try:
-        for filename in os.listdir(RESULTS_DIR):
-            if not filename.endswith('.json'):
-                continue
-                
-            filepath = os.path.join(RESULTS_DIR, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    test_data = json.load(f)
-                    completed_tests.append(test_data)
-            except (json.JSONDecodeError, FileNotFoundError) as e:
-                app.logger.warning(f"Не удалось загрузить файл {filename}: {e}")
-                continue
-                
+        filenames = [name for name in os.listdir(RESULTS_DIR) if name.endswith('.json')]
     except OSError as e:
         app.logger.error(f"Ошибка при чтении директории результатов: {e}")
+        return 0
     
-    return completed_tests
+    with get_db_writer() as conn:
+        known_filenames = {row[0] for row in conn.execute("SELECT filename FROM result_metadata")}
+    
+    new_filenames = [name for name in filenames if name not in known_filenames]
+    rows = []
+    for filename, test_data in zip(new_filenames, _json_load_pool.map(load_result_file, new_filenames)):
+        if test_data is None:
+            continue
+        # Корректный JSON, но не объект результата (список, строка, null)
+        if not isinstance(test_data, dict):
+            app.logger.warning(f"Файл {filename} пропущен: содержимое не является объектом JSON")
+            continue
+        rows.append(build_result_metadata_row(filename, test_data))
+    
+    if rows:
+        with get_db_writer() as conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO result_metadata ({RESULT_METADATA_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+    
+    app.logger.info(f"Добавлено в result_metadata файлов результатов: {len(rows)}")
+    return len(rows)
+
+
+def list_result_files(limit: Optional[int] = None, 
+                      after: Optional[Tuple[str, str]] = None) -> List[sqlite3.Row]:
+    """
+    Возвращает страницу записей result_metadata (новые первыми).
+    Использует keyset-пагинацию по паре (received_at, filename) вместо OFFSET.
+    
+    Args:
+        limit: Максимальное количество записей (None - без ограничения)
+        after: Ключ (received_at, filename) последней записи предыдущей страницы
+        
+    Returns:
+        List[sqlite3.Row]: Записи со столбцами filename и received_at
+    """
+    where_clause = "WHERE (received_at, filename) < (?, ?)" if after else ""
+    params = (*(after or ()), limit if limit is not None else -1)
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT filename, received_at FROM result_metadata
+        {where_clause}
+        ORDER BY received_at DESC, filename DESC
+        LIMIT ?
+    """, params)
+    return cursor.fetchall()
 
 
 # =============================================================================
 # МАРШРУТЫ ДЛЯ СТАТИЧЕСКИХ ФАЙЛОВ
 # =============================================================================
+# В промышленном режиме эти файлы отдает Nginx (см. deploy/nginx.conf),
+# маршруты ниже используются при запуске без обратного прокси.
 
 @app.route('/')
 def index():
@@ -448,39 +1419,53 @@ def save_results():
         JSON response с информацией о сохранении
     """
     try:
-        data = request.get_json()
+        # Тело разбирается orjson за один проход, без промежуточной копии в запросе
+        data = orjson.loads(read_request_body(MAX_SAVE_RESULTS_SIZE))
         user_ip = request.remote_addr
         
         # Валидация входных данных
-        is_valid, error_message = validate_json_data(data, ['userInfo', 'testResults'])
-        if not is_valid:
+        if not (isinstance(data, dict) and isinstance(data.get('userInfo'), dict)
+                and isinstance(data.get('testResults'), dict)):
+            error_message = "Поля userInfo и testResults обязательны и должны быть объектами"
             app.logger.warning(f"Получены невалидные данные от {user_ip}: {error_message}")
             return jsonify({"status": "error", "message": error_message}), 400
 
         user_info = data.get('userInfo', {})
         test_results = data.get('testResults', {})
         session_id = data.get('sessionId', 'Unknown')
+        score_percentage = test_results.get('percentage', 0)
+        
+        # Поля, которые записываются в столбцы result_metadata и certificates
+        if not (isinstance(session_id, str) and isinstance(data.get('testType', ''), str)
+                and isinstance(score_percentage, (int, float)) and not isinstance(score_percentage, bool)
+                and 0 <= score_percentage <= 100):
+            error_message = ("Поля sessionId и testType должны быть строками, "
+                             "testResults.percentage - числом от 0 до 100")
+            app.logger.warning(f"Получены невалидные данные от {user_ip}: {error_message}")
+            return jsonify({"status": "error", "message": error_message}), 400
         
-        # Добавляем метаданные сервера
-        data['serverReceiveTimestamp'] = datetime.now().isoformat()
+        # Добавляем метаданные сервера; одно значение времени используется для
+        # метки получения, периода номера, даты сертификата и имени файла
+        now = datetime.now()
+        received_at = now.isoformat()
+        data['serverReceiveTimestamp'] = received_at
         data['clientIp'] = user_ip
         
         official_document_number = None
-        score_percentage = test_results.get('percentage', 0)
+        certificate_row = None
         
         # Генерируем официальный номер документа при успешном прохождении
         if score_percentage >= PASSING_SCORE_THRESHOLD:
             try:
-                official_document_number = get_next_document_number()
+                official_document_number = get_next_document_number(now)
                 data['officialDocumentNumber'] = official_document_number
-                
-                # Сохраняем сертификат в БД
-                save_certificate_to_db(
+                certificate_row = build_certificate_row(
                     official_document_number,
                     user_info,
                     data.get('testType', 'N/A'),
                     score_percentage,
-                    session_id
+                    session_id,
+                    received_at
                 )
                 
             except Exception as e:
@@ -489,14 +1474,25 @@ def save_results():
         # Формируем имя файла
         last_name = sanitize_filename(user_info.get('lastName', 'Unknown'))
         first_name = sanitize_filename(user_info.get('firstName', 'User'))
-        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp_str = now.strftime("%Y%m%d_%H%M%S")
         doc_num_part = f"_{official_document_number.replace('/', '-')}" if official_document_number else ""
         filename = f"result_{last_name}_{first_name}{doc_num_part}_{timestamp_str}.json"
         
         # Сохраняем файл
-        filepath = os.path.join(RESULTS_DIR, filename)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        filename = create_result_file(filename, orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        
+        # Сертификат и метаданные записываются одной транзакцией; если запись
+        # не удалась, файл удаляется, чтобы не расходиться с result_metadata,
+        # а клиент получает ошибку и может повторить отправку
+        try:
+            saved = save_result_to_db(filename, data, certificate_row)
+        except BaseException:
+            os.remove(os.path.join(RESULTS_DIR, filename))
+            raise
+        if not saved:
+            os.remove(os.path.join(RESULTS_DIR, filename))
+            return jsonify({"status": "error", "message": "Database error"}), 500
+        close_open_session(session_id)
         
         app.logger.info(f"Результаты сохранены: {filename}, сессия: {session_id}, балл: {score_percentage}%")
         
@@ -510,6 +1506,8 @@ def save_results():
         
         return jsonify(response_data), 201
         
+    except RequestEntityTooLarge:
+        return request_too_large_response()
     except json.JSONDecodeError:
         app.logger.warning(f"Получены некорректные JSON данные от {request.remote_addr}")
         return jsonify({"status": "error", "message": "Invalid JSON data"}), 400
@@ -517,30 +1515,51 @@ def save_results():
         app.logger.error(f"Ошибка при сохранении файла: {e}")
         return jsonify({"status": "error", "message": "File system error"}), 500
     except Exception as e:
-        app.logger.error(f"Неожиданная ошибка при сохранении результатов: {e}")
-        app.logger.error(traceback.format_exc())
+        app.logger.exception(f"Неожиданная ошибка при сохранении результатов: {e}")
         return jsonify({"status": "error", "message": "Internal server error"}), 500
 
 
 @app.route('/api/get_results', methods=['GET'])
 def get_results_api():
     """
-    Возвращает все сохраненные результаты тестов из файловой системы.
+    Возвращает сохраненные результаты тестов из файловой системы.
+    
+    Query-параметры:
+        limit: Размер страницы (по умолчанию - все результаты)
+        cursor: Значение заголовка X-Next-Cursor из предыдущего ответа
     
     Returns:
-        JSON список всех результатов тестов, отсортированный по времени (новые первыми)
+        JSON список результатов тестов, отсортированный по времени (новые первыми)
     """
     try:
-        results_list = load_completed_tests()
-        
-        # Сортируем по времени получения сервером
-        results_list.sort(
-            key=lambda x: x.get('serverReceiveTimestamp', x.get('clientSubmitTimestamp', '')), 
-            reverse=True
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if limit is not None and limit <= 0:
+            return jsonify({"status": "error", "message": "Invalid limit"}), 400
+        
+        after = None
+        if cursor:
+            received_at, separator, filename = cursor.rpartition('|')
+            if not separator:
+                return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+            after = (received_at, filename)
+        
+        # Порядок по времени получения сервером задает индекс result_metadata
+        result_files = list_result_files(limit, after)
+        filenames = [row['filename'] for row in result_files]
+        
+        # Файлы отдаются клиенту по мере чтения как есть, без разбора и повторной
+        # сериализации: в result_metadata попадают только корректные JSON-файлы
+        response = Response(
+            stream_with_context(stream_raw_json_array(iter_result_files(filenames, read_result_file))),
+            mimetype='application/json'
         )
+        if limit is not None and len(result_files) == limit:
+            last_row = result_files[-1]
+            response.headers['X-Next-Cursor'] = f"{last_row['received_at']}|{last_row['filename']}"
         
-        app.logger.info(f"Отправлено {len(results_list)} результатов тестов")
-        return jsonify(results_list), 200
+        app.logger.info(f"Отправка {len(filenames)} результатов тестов")
+        return response, 200
         
     except Exception as e:
         app.logger.error(f"Ошибка при получении результатов: {e}")
@@ -554,39 +1573,51 @@ def get_results_api():
 @app.route('/api/log_event', methods=['POST'])
 def log_event():
     """
-    Принимает и логирует единичное событие прокторинга в базу данных.
+    Принимает единичное событие прокторинга и ставит его в очередь на запись в БД.
     
     Returns:
-        JSON response с результатом операции
+        JSON response с результатом операции (202 - событие принято)
     """
     try:
-        data = request.get_json()
+        data = orjson.loads(read_request_body(MAX_LOG_EVENT_SIZE))
         user_ip = request.remote_addr
         
-        # Валидация обязательных полей
-        is_valid, error_message = validate_json_data(data, ['sessionId', 'eventType'])
-        if not is_valid:
+        # Валидация обязательных полей: проверки под форму события вместо
+        # общего обхода списка полей, так как это самый частый запрос
+        if not (isinstance(data, dict) and isinstance(data.get('sessionId'), str)
+                and isinstance(data.get('eventType'), str)):
+            error_message = "Поля sessionId и eventType обязательны и должны быть строками"
             app.logger.warning(f"Получено невалидное событие от {user_ip}: {error_message}")
             return jsonify({"status": "error", "message": error_message}), 400
         
-        session_id = data.get('sessionId')
-        event_type = data.get('eventType')
-        event_timestamp = data.get('eventTimestamp', datetime.now().isoformat())
-        details = data.get('details', {})
+        details = data.get('details') or {}
+        if not isinstance(details, dict):
+            error_message = "Поле details должно быть объектом"
+            app.logger.warning(f"Получено невалидное событие от {user_ip}: {error_message}")
+            return jsonify({"status": "error", "message": error_message}), 400
+        
+        event_timestamp = data.get('eventTimestamp')
+        if event_timestamp is not None and not isinstance(event_timestamp, str):
+            error_message = "Поле eventTimestamp должно быть строкой"
+            app.logger.warning(f"Получено невалидное событие от {user_ip}: {error_message}")
+            return jsonify({"status": "error", "message": error_message}), 400
+        
+        session_id = data['sessionId']
+        event_type = data['eventType']
+        event_timestamp = event_timestamp or datetime.now(timezone.utc).isoformat()
         details['ip'] = user_ip
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO proctoring_events (session_id, event_type, event_timestamp, details) 
-               VALUES (?, ?, ?, ?)""",
-            (session_id, event_type, event_timestamp, json.dumps(details))
-        )
-        conn.commit()
-        
-        app.logger.debug(f"Событие {event_type} записано для сессии {session_id}")
-        return jsonify({"status": "success"}), 200
+        # Запись выполняется фоновым потоком пакетами в одной транзакции
+        if not enqueue_event(build_event_row(session_id, event_type, event_timestamp, details)):
+            app.logger.error(f"Буфер событий переполнен, событие {event_type} сессии {session_id} отклонено")
+            return jsonify({"status": "error", "message": "Event queue is full"}), 503
+
+        # Ленивое форматирование: строка не собирается, если DEBUG отключен
+        app.logger.debug("Событие %s поставлено в очередь для сессии %s", event_type, session_id)
+        return jsonify({"status": "accepted"}), 202
         
+    except RequestEntityTooLarge:
+        return request_too_large_response()
     except json.JSONDecodeError:
         app.logger.warning(f"Получены некорректные JSON данные события от {request.remote_addr}")
         return jsonify({"status": "error", "message": "Invalid JSON data"}), 400
@@ -615,16 +1646,36 @@ def get_events(session_id: str):
         
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """SELECT * FROM proctoring_events 
-               WHERE session_id = ? 
-               ORDER BY event_timestamp ASC""",
-            (session_id,)
-        )
-        events = [dict(row) for row in cursor.fetchall()]
         
-        app.logger.info(f"Отправлено {len(events)} событий для сессии {session_id}")
-        return jsonify(events), 200
+        # Список событий меняется только с приходом новых событий сессии
+        cursor.execute("""
+            SELECT COUNT(*), MAX(event_timestamp) 
+            FROM ev.proctoring_events WHERE session_id = ?
+        """, (session_id,))
+        events_count, last_event_timestamp = cursor.fetchone()
+        cache_key = ('events', session_id, (events_count, last_event_timestamp))
+        payload = cache_get(cache_key)
+        
+        if payload is None:
+            cursor.execute(
+                """SELECT id, session_id, event_type, event_timestamp, details, 
+                          duration_sec, scroll_depth_pct 
+                   FROM ev.proctoring_events 
+                   WHERE session_id = ? 
+                   ORDER BY event_timestamp ASC, id ASC""",
+                (session_id,)
+            )
+            # Строки сериализуются по мере чтения курсора, без промежуточного
+            # списка словарей всех событий сессии; имена столбцов берутся
+            # из описания курсора один раз, а не через ключи каждой строки
+            columns = [column[0] for column in cursor.description]
+            payload = b''.join(stream_raw_json_array(
+                orjson.dumps(dict(zip(columns, row))) for row in cursor
+            ))
+            cache_set(cache_key, payload, EVENTS_CACHE_TIMEOUT)
+            app.logger.info(f"Отправлено {events_count} событий для сессии {session_id}")
+        
+        return conditional_json_response(payload, cache_key)
         
     except sqlite3.Error as e:
         app.logger.error(f"Ошибка БД при получении событий для сессии {session_id}: {e}")
@@ -649,11 +1700,21 @@ def get_certificates():
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM certificates ORDER BY issue_date DESC")
-        certificates = [dict(row) for row in cursor.fetchall()]
         
-        app.logger.info(f"Отправлено {len(certificates)} сертификатов")
-        return jsonify(certificates), 200
+        # Сертификаты только добавляются, поэтому реестр меняется вместе с MAX(rowid)
+        cursor.execute("SELECT MAX(rowid) FROM certificates")
+        cache_key = ('certificates', cursor.fetchone()[0])
+        payload = cache_get(cache_key)
+        
+        if payload is None:
+            cursor.execute("SELECT * FROM certificates ORDER BY issue_date DESC")
+            columns = [column[0] for column in cursor.description]
+            certificates = [dict(zip(columns, row)) for row in cursor]
+            payload = orjson.dumps(certificates)
+            cache_set(cache_key, payload, CERTIFICATES_CACHE_TIMEOUT)
+            app.logger.info(f"Отправлено {len(certificates)} сертификатов")
+        
+        return conditional_json_response(payload, cache_key)
         
     except sqlite3.Error as e:
         app.logger.error(f"Ошибка БД при получении сертификатов: {e}")
@@ -667,103 +1728,136 @@ def get_certificates():
 # ФУНКЦИИ ДЛЯ АНАЛИТИКИ
 # =============================================================================
 
-def get_completed_session_ids() -> set:
-    """
-    Получает ID всех успешно завершенных сессий из JSON-файлов.
-    
-    Returns:
-        set: Множество ID завершенных сессий
-    """
-    completed_session_ids = set()
-    completed_tests = load_completed_tests()
-    
-    for test_data in completed_tests:
-        session_id = test_data.get('sessionId')
-        if session_id and isinstance(session_id, str):
-            completed_session_ids.add(session_id)
-    
-    return completed_session_ids
-
-
-def get_all_started_sessions() -> List[sqlite3.Row]:
+def get_abandoned_session_rows() -> List[sqlite3.Row]:
     """
-    Получает информацию о всех начатых сессиях из базы данных.
+    Получает начатые, но не завершенные сессии с метриками нарушений
+    и первым стартовым событием (test_started/study_started) одним запросом.
+    Агрегируются только события сессий из open_sessions; сессии, результат
+    которых пришел раньше их последних событий, исключаются по result_metadata.
     
     Returns:
-        List[sqlite3.Row]: Список записей о начатых сессиях с метриками нарушений
+        List[sqlite3.Row]: Записи о прерванных сессиях, новые первыми;
+                           поля start_* равны NULL, если стартового
+                           события нет
     """
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("""
+            WITH sessions AS (
+                SELECT 
+                    o.session_id, 
+                    MIN(e.event_timestamp) as start_time,
+                    COUNT(*) FILTER (WHERE e.event_type = 'focus_loss') as focus_loss_count,
+                    COUNT(*) FILTER (WHERE e.event_type = 'screenshot_attempt') as screenshot_count,
+                    COUNT(*) FILTER (WHERE e.event_type = 'print_attempt') as print_count,
+                    MIN(e.id) FILTER (
+                        WHERE e.event_type IN ('test_started', 'study_started')
+                    ) as start_event_id
+                FROM ev.open_sessions o
+                JOIN ev.proctoring_events e ON e.session_id = o.session_id
+                WHERE o.session_id NOT IN (
+                    SELECT session_id FROM main.result_metadata WHERE session_id IS NOT NULL
+                )
+                GROUP BY o.session_id
+            )
             SELECT 
-                session_id, 
-                MIN(event_timestamp) as start_time,
-                SUM(CASE WHEN event_type = 'focus_loss' THEN 1 ELSE 0 END) as focus_loss_count,
-                SUM(CASE WHEN event_type = 'screenshot_attempt' THEN 1 ELSE 0 END) as screenshot_count,
-                SUM(CASE WHEN event_type = 'print_attempt' THEN 1 ELSE 0 END) as print_count
-            FROM proctoring_events
-            GROUP BY session_id
+                s.*, 
+                se.event_type as start_event_type, 
+                se.client_ip as start_client_ip,
+                se.persistent_id as start_persistent_id,
+                json_extract(
+                    CASE WHEN json_valid(se.details) THEN se.details END, '$.userInfo'
+                ) as start_user_info
+            FROM sessions s
+            LEFT JOIN ev.proctoring_events se ON se.id = s.start_event_id
+            ORDER BY s.start_time DESC
         """)
         return cursor.fetchall()
         
     except sqlite3.Error as e:
-        app.logger.error(f"Ошибка при получении начатых сессий: {e}")
+        app.logger.error(f"Ошибка при получении прерванных сессий: {e}")
         return []
 
 
-def get_session_user_info(session_id: str) -> Tuple[Dict[str, Any], str, str]:
+def parse_session_user_info(session_id: str, event_type: Optional[str], client_ip: Optional[str],
+                            persistent_id: Optional[str], 
+                            user_info_json: Optional[str]) -> Tuple[Dict[str, Any], str, str]:
     """
-    Получает информацию о пользователе и сессии из событий прокторинга.
+    Формирует информацию о пользователе и сессии по полям стартового события,
+    извлеченным из details средствами SQLite.
     
     Args:
         session_id: ID сессии
+        event_type: Тип стартового события (test_started или study_started)
+        client_ip: IP адрес из стартового события
+        persistent_id: Постоянный ID пользователя из стартового события
+        user_info_json: Объект userInfo стартового события в формате JSON
         
     Returns:
         Tuple: (user_info, client_ip, session_type)
     """
+    user_info = {}
+    session_type = "unknown"
+    
+    if event_type:
+        try:
+            start_user_info = orjson.loads(user_info_json) if user_info_json is not None else None
+            
+            if event_type == 'test_started':
+                session_type = "test"
+                user_info = start_user_info if start_user_info is not None else {"lastName": "N/A"}
+            elif event_type == 'study_started':
+                session_type = "study"
+                if start_user_info and start_user_info.get('lastName'):
+                    user_info = start_user_info
+                else:
+                    user_info = {
+                        "lastName": "Учебная сессия",
+                        "firstName": f"ID: {persistent_id[:8]}..." if persistent_id else 'N/A'
+                    }
+        except (orjson.JSONDecodeError, AttributeError) as e:
+            app.logger.warning(f"Ошибка при парсинге данных сессии {session_id}: {e}")
+            user_info = {"lastName": "Ошибка данных"}
+    
+    return user_info, client_ip or "N/A", session_type
+
+
+def get_behavior_candidates() -> List[sqlite3.Row]:
+    """
+    Отбирает по result_metadata тесты, сданные на высокий балл быстрее порога
+    для своего типа. Только для них нужны поиск учебной сессии и расчет
+    индекса вовлеченности; файлы результатов при этом не читаются.
+    
+    Returns:
+        List[sqlite3.Row]: Кандидаты (новые первыми) с длительностью теста
+                           в секундах и страницей обучения для его типа
+    """
+    thresholds_rows = []
+    for test_type, study_page in TEST_TO_STUDY_PAGE_MAP.items():
+        thresholds = BEHAVIOR_THRESHOLDS.get(test_type, BEHAVIOR_THRESHOLDS['default'])
+        thresholds_rows.extend((
+            test_type, study_page, thresholds['min_score'], thresholds['max_test_duration_sec']
+        ))
+    values_sql = ", ".join(["(?, ?, ?, ?)"] * len(TEST_TO_STUDY_PAGE_MAP))
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT details, event_type FROM proctoring_events 
-            WHERE session_id = ? AND (event_type = 'test_started' OR event_type = 'study_started') 
-            LIMIT 1
-        """, (session_id,))
-        start_event_row = cursor.fetchone()
-        
-        user_info = {}
-        client_ip = "N/A"
-        session_type = "unknown"
-        
-        if start_event_row:
-            try:
-                details_json = json.loads(start_event_row['details'])
-                client_ip = details_json.get('ip', "N/A")
-                
-                if start_event_row['event_type'] == 'test_started':
-                    session_type = "test"
-                    user_info = details_json.get('userInfo', {"lastName": "N/A"})
-                elif start_event_row['event_type'] == 'study_started':
-                    session_type = "study"
-                    temp_user_info = details_json.get('userInfo')
-                    if temp_user_info and temp_user_info.get('lastName'):
-                        user_info = temp_user_info
-                    else:
-                        persistent_id = details_json.get('persistentId', 'N/A')
-                        user_info = {
-                            "lastName": "Учебная сессия",
-                            "firstName": f"ID: {persistent_id[:8]}..." if persistent_id else 'N/A'
-                        }
-            except (json.JSONDecodeError, AttributeError, KeyError) as e:
-                app.logger.warning(f"Ошибка при парсинге данных сессии {session_id}: {e}")
-                user_info = {"lastName": "Ошибка данных"}
-        
-        return user_info, client_ip, session_type
+        cursor.execute(f"""
+            WITH thresholds(test_type, study_page, min_score, max_duration) AS (VALUES {values_sql})
+            SELECT m.filename, m.session_id, m.test_type, m.score_percentage, m.start_time, 
+                   m.persistent_id, m.client_ip, t.study_page, m.test_duration_sec AS test_duration
+            FROM result_metadata m JOIN thresholds t ON t.test_type = m.test_type
+            WHERE m.score_percentage >= t.min_score AND m.test_duration_sec < t.max_duration
+            AND (COALESCE(m.persistent_id, '') <> '' OR COALESCE(m.client_ip, '') <> '')
+            ORDER BY m.received_at DESC, m.filename DESC
+        """, thresholds_rows)
+        return cursor.fetchall()
         
     except sqlite3.Error as e:
-        app.logger.error(f"Ошибка БД при получении информации о сессии {session_id}: {e}")
-        return {"lastName": "Ошибка БД"}, "N/A", "unknown"
+        app.logger.error(f"Ошибка БД при отборе тестов для поведенческого анализа: {e}")
+        return []
 
 
 def find_related_study_session(test_start_time: str, test_persistent_id: str, 
@@ -784,124 +1878,128 @@ def find_related_study_session(test_start_time: str, test_persistent_id: str,
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Сначала ищем по persistent ID
-        if test_persistent_id:
-            cursor.execute("""
-                SELECT session_id FROM proctoring_events
-                WHERE event_type = 'study_started' AND event_timestamp < ? 
-                AND json_extract(details, '$.persistentId') = ?
-                AND json_extract(details, '$.page') = ?
-                GROUP BY session_id ORDER BY MIN(event_timestamp) DESC LIMIT 1
-            """, (test_start_time, test_persistent_id, required_study_page))
-            result = cursor.fetchone()
-            if result:
-                return result['session_id']
-        
-        # Если не нашли по ID, ищем по IP в пределах 24 часов
-        if test_ip:
-            cursor.execute("""
-                SELECT session_id FROM proctoring_events
-                WHERE event_type = 'study_started' AND event_timestamp < ? 
-                AND json_extract(details, '$.ip') = ?
-                AND datetime(event_timestamp) > datetime(?, '-{} hours')
-                AND json_extract(details, '$.page') = ?
-                GROUP BY session_id ORDER BY MIN(event_timestamp) DESC LIMIT 1
-            """.format(MAX_STUDY_SESSION_LOOKUP_HOURS), 
-            (test_start_time, test_ip, test_start_time, required_study_page))
-            result = cursor.fetchone()
-            if result:
-                return result['session_id']
-        
-        return None
+        # Результат может измениться только с появлением учебной сессии этого
+        # пользователя на этой странице; версия по последним study_started с его
+        # persistent ID и IP видна всем процессам сразу после записи события.
+        # Каждый MAX читает только записи пользователя в частичном индексе,
+        # а учебные сессии других пользователей не сбрасывают кэш
+        cursor.execute("""
+            SELECT
+                (SELECT MAX(id) FROM ev.proctoring_events 
+                 WHERE event_type = 'study_started' AND persistent_id = :persistent_id AND page = :page),
+                (SELECT MAX(id) FROM ev.proctoring_events 
+                 WHERE event_type = 'study_started' AND client_ip = :ip AND page = :page)
+        """, {'persistent_id': test_persistent_id, 'ip': test_ip, 'page': required_study_page})
+        cache_key = ('related_study_session', test_start_time, test_persistent_id, 
+                     test_ip, required_study_page, tuple(cursor.fetchone()))
+        cached_session = cache_get(cache_key)
+        if cached_session is not None:
+            return cached_session[0]
+        
+        # Один запрос вместо двух последовательных: совпадение по persistent ID
+        # (приоритет 1) предпочтительнее совпадения по IP в пределах 24 часов
+        cursor.execute("""
+            WITH 
+                bounds AS (SELECT {} AS test_start_ms),
+                matches AS (
+                    SELECT session_id, 1 AS priority, event_timestamp_ms 
+                    FROM ev.proctoring_events, bounds
+                    WHERE event_type = 'study_started' AND event_timestamp_ms < test_start_ms
+                    AND :persistent_id <> '' AND persistent_id = :persistent_id AND page = :page
+                    UNION ALL
+                    SELECT session_id, 2 AS priority, event_timestamp_ms 
+                    FROM ev.proctoring_events, bounds
+                    WHERE event_type = 'study_started' 
+                    AND event_timestamp_ms > test_start_ms - {} AND event_timestamp_ms < test_start_ms
+                    AND :ip <> '' AND client_ip = :ip AND page = :page
+                )
+            SELECT session_id FROM matches
+            GROUP BY priority, session_id 
+            ORDER BY priority, MIN(event_timestamp_ms) DESC LIMIT 1
+        """.format(EPOCH_MS_SQL.format(':test_start_time'), MAX_STUDY_SESSION_LOOKUP_HOURS * 3600 * 1000), {
+            'test_start_time': test_start_time,
+            'persistent_id': test_persistent_id,
+            'ip': test_ip,
+            'page': required_study_page,
+        })
+        result = cursor.fetchone()
+        study_session_id = result['session_id'] if result else None
+        
+        # Отсутствие связанной сессии тоже кэшируется, поэтому значение
+        # хранится в кортеже
+        cache_set(cache_key, (study_session_id,), STUDY_SESSION_CACHE_TIMEOUT)
+        return study_session_id
         
     except sqlite3.Error as e:
         app.logger.error(f"Ошибка при поиске связанной учебной сессии: {e}")
         return None
 
 
-def calculate_engagement_score(study_session_id: str) -> Tuple[int, int]:
+def calculate_engagement_scores(study_session_ids: List[str]) -> Dict[str, Tuple[int, int]]:
     """
-    Рассчитывает индекс вовлеченности пользователя в учебную сессию.
+    Рассчитывает индексы вовлеченности сразу для нескольких учебных сессий
+    одним сгруппированным запросом.
     
     Args:
-        study_session_id: ID учебной сессии
+        study_session_ids: ID учебных сессий
         
     Returns:
-        Tuple[int, int]: (engagement_score, study_duration_seconds)
+        Dict: session_id -> (engagement_score, study_duration_seconds); сессии
+              без событий или при ошибке БД отсутствуют в словаре
     """
+    if not study_session_ids:
+        return {}
+    
+    session_ids_param = orjson.dumps(sorted(study_session_ids)).decode()
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        engagement_score = 0
-        study_duration = 0
-        
-        # Вычисляем длительность сессии
+        # Индексы меняются только с приходом новых событий этих сессий; id событий
+        # растет монотонно, а MAX(id) читается из индекса по session_id
         cursor.execute("""
-            SELECT MIN(event_timestamp), MAX(event_timestamp) 
-            FROM proctoring_events WHERE session_id = ?
-        """, (study_session_id,))
-        times = cursor.fetchone()
-        
-        if times and times[0] and times[1]:
-            try:
-                start = datetime.fromisoformat(times[0].replace('Z', ''))
-                end = datetime.fromisoformat(times[1].replace('Z', ''))
-                study_duration = int((end - start).total_seconds())
-            except ValueError as e:
-                app.logger.warning(f"Ошибка при парсинге времени для сессии {study_session_id}: {e}")
-        
-        # Баллы за время просмотра модулей
-        cursor.execute("""
-            SELECT details FROM proctoring_events 
-            WHERE session_id = ? AND event_type = 'module_view_time'
-        """, (study_session_id,))
-        module_events = cursor.fetchall()
-        
-        total_module_view_time = 0
-        for row in module_events:
-            try:
-                details = json.loads(row['details'])
-                total_module_view_time += details.get('duration', 0)
-            except (json.JSONDecodeError, KeyError):
-                continue
-        
-        engagement_score += int(total_module_view_time / 60)  # 1 балл за минуту
-        
-        # Баллы за прокрутку
-        cursor.execute("""
-            SELECT details FROM proctoring_events 
-            WHERE session_id = ? AND event_type = 'scroll_depth_milestone'
-        """, (study_session_id,))
-        scroll_events = cursor.fetchall()
-        
-        max_depth = 0
-        for row in scroll_events:
-            try:
-                details = json.loads(row['details'])
-                depth_str = details.get('depth', '0%').replace('%', '')
-                max_depth = max(max_depth, int(depth_str))
-            except (json.JSONDecodeError, ValueError, KeyError):
-                continue
-        
-        if max_depth >= 95:
-            engagement_score += 10
-        elif max_depth >= 50:
-            engagement_score += 5
-        
-        # Баллы за ответы на вопросы самоконтроля
+            SELECT MAX(id) FROM ev.proctoring_events 
+            WHERE session_id IN (SELECT value FROM json_each(?))
+        """, (session_ids_param,))
+        cache_key = ('engagement_scores', session_ids_param, cursor.fetchone()[0])
+        cached_scores = cache_get(cache_key)
+        if cached_scores is not None:
+            return cached_scores
+        
+        # Показатели и сам индекс всех сессий вычисляются за один проход по их
+        # событиям: 1 балл за минуту просмотра модулей, 10/5 баллов за прокрутку
+        # до 95%/50% и 2 балла за каждый ответ на вопрос самоконтроля
         cursor.execute("""
-            SELECT COUNT(*) FROM proctoring_events 
-            WHERE session_id = ? AND event_type = 'self_check_answered'
-        """, (study_session_id,))
-        self_check_count = cursor.fetchone()[0]
-        engagement_score += self_check_count * 2
-        
-        return engagement_score, study_duration
+            WITH stats AS (
+                SELECT 
+                    session_id,
+                    (MAX(event_timestamp_ms) - MIN(event_timestamp_ms)) / 1000 AS study_duration,
+                    COALESCE(SUM(duration_sec) FILTER (WHERE event_type = 'module_view_time'), 0) AS view_time,
+                    COALESCE(MAX(scroll_depth_pct) FILTER (WHERE event_type = 'scroll_depth_milestone'), 0) AS max_depth,
+                    COUNT(*) FILTER (WHERE event_type = 'self_check_answered') AS self_check_count
+                FROM ev.proctoring_events 
+                WHERE session_id IN (SELECT value FROM json_each(?))
+                GROUP BY session_id
+            )
+            SELECT 
+                session_id,
+                CAST(view_time / 60 AS INTEGER)
+                    + CASE WHEN max_depth >= 95 THEN 10 WHEN max_depth >= 50 THEN 5 ELSE 0 END
+                    + self_check_count * 2 AS engagement_score,
+                COALESCE(study_duration, 0) AS study_duration
+            FROM stats
+        """, (session_ids_param,))
+        scores = {
+            row['session_id']: (row['engagement_score'], row['study_duration'])
+            for row in cursor
+        }
+        cache_set(cache_key, scores, ENGAGEMENT_CACHE_TIMEOUT)
+        return scores
         
     except sqlite3.Error as e:
-        app.logger.error(f"Ошибка при расчете индекса вовлеченности для сессии {study_session_id}: {e}")
-        return 0, 0
+        app.logger.error(f"Ошибка при расчете индексов вовлеченности: {e}")
+        return {}
 
 
 # =============================================================================
@@ -917,17 +2015,28 @@ def get_abandoned_sessions():
         JSON список прерванных сессий с информацией о пользователях и нарушениях
     """
     try:
-        completed_session_ids = get_completed_session_ids()
-        all_started_sessions = get_all_started_sessions()
-        
-        abandoned_sessions = []
+        conn = get_db_connection()
+        cursor = conn.cursor()
         
-        for session in all_started_sessions:
-            session_id = session['session_id']
-            
-            # Если сессия была начата, но не завершена
-            if session_id not in completed_session_ids:
-                user_info, client_ip, session_type = get_session_user_info(session_id)
+        # Список меняется с новыми событиями и с закрытием сессий при сохранении
+        # результата (удаление из open_sessions уменьшает их число)
+        cursor.execute("""
+            SELECT 
+                (SELECT MAX(id) FROM ev.proctoring_events),
+                (SELECT COUNT(*) FROM ev.open_sessions),
+                (SELECT MAX(rowid) FROM main.result_metadata)
+        """)
+        cache_key = ('abandoned_sessions', tuple(cursor.fetchone()))
+        payload = cache_get(cache_key)
+        
+        if payload is None:
+            abandoned_sessions = []
+            for session in get_abandoned_session_rows():
+                session_id = session['session_id']
+                user_info, client_ip, session_type = parse_session_user_info(
+                    session_id, session['start_event_type'], session['start_client_ip'],
+                    session['start_persistent_id'], session['start_user_info']
+                )
                 
                 abandoned_sessions.append({
                     "sessionId": session_id,
@@ -941,16 +2050,15 @@ def get_abandoned_sessions():
                         "prints": session['print_count']
                     }
                 })
+            
+            payload = orjson.dumps(abandoned_sessions)
+            cache_set(cache_key, payload, ABANDONED_SESSIONS_CACHE_TIMEOUT)
+            app.logger.info(f"Найдено {len(abandoned_sessions)} прерванных сессий")
         
-        # Сортируем по времени начала (новые первыми)
-        abandoned_sessions.sort(key=lambda x: x['startTime'], reverse=True)
-        
-        app.logger.info(f"Найдено {len(abandoned_sessions)} прерванных сессий")
-        return jsonify(abandoned_sessions), 200
+        return conditional_json_response(payload, cache_key)
 
     except Exception as e:
-        app.logger.error(f"Ошибка при получении прерванных сессий: {e}")
-        app.logger.error(traceback.format_exc())
+        app.logger.exception(f"Ошибка при получении прерванных сессий: {e}")
         return jsonify({"status": "error", "message": "Error analyzing abandoned sessions"}), 500
 
 
@@ -964,49 +2072,31 @@ def get_behavior_analysis():
         JSON список подозрительных сессий с детальным анализом
     """
     try:
-        completed_tests = load_completed_tests()
         suspicious_sessions = []
 
-        for test in completed_tests:
-            test_start_time = test.get('sessionMetrics', {}).get('startTime')
-            test_persistent_id = test.get('persistentId', {}).get('cookie')
-            test_ip = test.get('clientIp')
-            test_type = test.get('testType', 'default')
-            
-            # Получаем пороги для текущего типа теста
-            thresholds = BEHAVIOR_THRESHOLDS.get(test_type, BEHAVIOR_THRESHOLDS['default'])
-            required_study_page = TEST_TO_STUDY_PAGE_MAP.get(test_type)
-            
-            # Проверяем наличие необходимых данных
-            if not all([test_start_time, required_study_page, (test_persistent_id or test_ip)]):
-                continue
-            
-            # Ищем связанную учебную сессию
-            study_session_id = find_related_study_session(
-                test_start_time, test_persistent_id, test_ip, required_study_page
+        # Балл и длительность теста проверяются в SQL по result_metadata
+        candidates = get_behavior_candidates()
+        
+        # Ищем связанные учебные сессии, затем считаем вовлеченность
+        # по всем найденным сессиям одним запросом
+        study_session_ids = [
+            find_related_study_session(
+                test['start_time'], test['persistent_id'], test['client_ip'], test['study_page']
             )
-            
-            engagement_score = 0
-            study_duration = 0
-            
-            if study_session_id:
-                engagement_score, study_duration = calculate_engagement_score(study_session_id)
-            
-            # Вычисляем метрики теста
-            try:
-                test_duration = (
-                    datetime.fromisoformat(test['sessionMetrics']['endTime'].replace('Z', '')) -
-                    datetime.fromisoformat(test['sessionMetrics']['startTime'].replace('Z', ''))
-                ).total_seconds()
-                test_score = test['testResults']['percentage']
-            except (KeyError, ValueError) as e:
-                app.logger.warning(f"Ошибка при обработке метрик теста: {e}")
-                continue
+            for test in candidates
+        ]
+        engagement_scores = calculate_engagement_scores(
+            list({session_id for session_id in study_session_ids if session_id})
+        )
+        
+        for test, study_session_id in zip(candidates, study_session_ids):
+            thresholds = BEHAVIOR_THRESHOLDS.get(test['test_type'], BEHAVIOR_THRESHOLDS['default'])
+            engagement_score, study_duration = engagement_scores.get(study_session_id, (0, 0))
             
             # Проверяем подозрительные паттерны
-            if (test_score >= thresholds['min_score'] and
-                test_duration < thresholds['max_test_duration_sec'] and
-                engagement_score < thresholds['min_engagement_score']):
+            if engagement_score < thresholds['min_engagement_score']:
+                test_score = test['score_percentage']
+                test_duration = test['test_duration']
                 
                 reason = (
                     f"Высокий балл ({test_score}%) при быстром прохождении "
@@ -1014,8 +2104,11 @@ def get_behavior_analysis():
                     f"(Очки: {engagement_score})."
                 )
                 
+                # Файл результата читается только ради данных пользователя
+                test_data = load_result_file(test['filename']) or {}
+                
                 suspicious_sessions.append({
-                    "userInfo": test.get('userInfo'),
+                    "userInfo": test_data.get('userInfo'),
                     "testResult": {
                         "score": test_score, 
                         "duration": int(test_duration)
@@ -1025,15 +2118,14 @@ def get_behavior_analysis():
                         "engagementScore": engagement_score
                     },
                     "reason": reason,
-                    "sessionId": test.get('sessionId')
+                    "sessionId": test['session_id']
                 })
 
         app.logger.info(f"Найдено {len(suspicious_sessions)} подозрительных сессий")
-        return jsonify(suspicious_sessions), 200
+        return Response(orjson.dumps(suspicious_sessions), mimetype='application/json'), 200
 
     except Exception as e:
-        app.logger.error(f"Ошибка при поведенческом анализе: {e}")
-        app.logger.error(traceback.format_exc())
+        app.logger.exception(f"Ошибка при поведенческом анализе: {e}")
         return jsonify({"status": "error", "message": "Error in behavioral analysis"}), 500
 
 
@@ -1049,11 +2141,15 @@ if __name__ == '__main__':
         print(f"Ошибка при инициализации базы данных: {e}")
         exit(1)
     
+    # Отладчик и автоперезагрузка только по явному FLASK_DEBUG=1: встроенный
+    # сервер предназначен для разработки, в эксплуатации используется Gunicorn
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    
     # Проверка наличия SSL сертификатов
     if os.path.exists(SSL_CERT_PATH) and os.path.exists(SSL_KEY_PATH):
         print("--- Запуск в режиме HTTPS ---")
         ssl_context = (SSL_CERT_PATH, SSL_KEY_PATH)
-        app.run(host='0.0.0.0', port=5000, debug=True, ssl_context=ssl_context)
+        app.run(host='0.0.0.0', port=5000, debug=debug, ssl_context=ssl_context)
     else:
         print("--- Файлы сертификата не найдены. Запуск в обычном режиме HTTP ---")
-        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+        app.run(host='0.0.0.0', port=5000, debug=debug)
\ No newline at end of file
@@ -1,6 +1,12 @@
 # file: tests/test_app.py
 
+import io
+import os
+import json
+import sqlite3
+import time
 import pytest
+import app as app_module
 from app import app as flask_app
 
 @pytest.fixture
@@ -13,6 +19,22 @@ def client(app):
     """A test client for the app."""
     return app.test_client()
 
+@pytest.fixture
+def db_client(app, tmp_path, monkeypatch):
+    """A test client bound to a temporary database and results directory."""
+    results_dir = tmp_path / "results_data"
+    results_dir.mkdir()
+    monkeypatch.setattr(app_module, "DATABASE_PATH", str(tmp_path / "app_data.db"))
+    monkeypatch.setattr(app_module, "EVENTS_DATABASE_PATH", str(tmp_path / "events.db"))
+    monkeypatch.setattr(app_module, "RESULTS_DIR", str(results_dir))
+    app_module.close_db_connections()
+    app_module._reserved_document_numbers.clear()
+    app_module._memo_cache.clear()
+    app_module.init_db()
+    yield app.test_client()
+    app_module.flush_event_buffer()
+    app_module.close_db_connections()
+
 def test_index_route(client):
     """
     Тест для проверки, что главная страница (/) загружается успешно.
@@ -20,3 +42,465 @@ def test_index_route(client):
     response = client.get('/')
     assert response.status_code == 200
     assert "Основы информационной безопасности".encode('utf-8') in response.data
+
+def test_log_event_is_written_in_batch(db_client):
+    """
+    Тест для проверки, что события из буфера попадают в БД после сброса.
+    """
+    for event_type in ('test_started', 'focus_loss'):
+        response = db_client.post('/api/log_event', json={
+            'sessionId': 'session-1',
+            'eventType': event_type,
+            'eventTimestamp': '2024-01-01T10:00:00.000Z',
+        })
+        assert response.status_code == 202
+
+    app_module.flush_event_buffer()
+
+    events = db_client.get('/api/get_events/session-1').get_json()
+    assert [event['event_type'] for event in events] == ['test_started', 'focus_loss']
+
+    db_client.post('/api/log_event', json={
+        'sessionId': 'session-1', 'eventType': 'focus_loss',
+        'eventTimestamp': '2024-01-01T09:59:00.000Z',
+    })
+    app_module.flush_event_buffer()
+
+    events = db_client.get('/api/get_events/session-1').get_json()
+    assert [event['event_type'] for event in events] == ['focus_loss', 'test_started', 'focus_loss']
+
+def test_get_results_uses_metadata_index(db_client):
+    """
+    Тест для проверки, что результаты, сохраненные до появления индекса
+    и через API, возвращаются новыми первыми.
+    """
+    legacy = {'sessionId': 'legacy', 'serverReceiveTimestamp': '2024-01-01T10:00:00'}
+    with open(os.path.join(app_module.RESULTS_DIR, 'result_legacy.json'), 'w', encoding='utf-8') as f:
+        json.dump(legacy, f)
+    # Файлы с корректным JSON, но не объектом или с вложенными полями
+    # неверного типа не прерывают индексацию
+    for name, content in (('result_list.json', []), ('result_null.json', None),
+                          ('result_odd.json', {'sessionId': {'id': 1}, 'testResults': [50],
+                                               'serverReceiveTimestamp': '2023-01-01T10:00:00'})):
+        with open(os.path.join(app_module.RESULTS_DIR, name), 'w', encoding='utf-8') as f:
+            json.dump(content, f)
+    assert app_module.backfill_metadata() == 2
+
+    response = db_client.post('/api/save_results', json={
+        'sessionId': 'fresh',
+        'userInfo': {'lastName': 'Иванов', 'firstName': 'Иван'},
+        'testResults': {'percentage': 50},
+    })
+    assert response.status_code == 201
+
+    results = db_client.get('/api/get_results').get_json()
+    assert [result['sessionId'] for result in results] == ['fresh', 'legacy', {'id': 1}]
+
+def test_get_results_keyset_pagination(db_client):
+    """
+    Тест для проверки постраничной выдачи результатов через X-Next-Cursor.
+    """
+    for index in range(3):
+        with open(os.path.join(app_module.RESULTS_DIR, f'result_{index}.json'), 'w', encoding='utf-8') as f:
+            json.dump({'sessionId': f's{index}', 'serverReceiveTimestamp': f'2024-01-0{index + 1}T10:00:00'}, f)
+    app_module.backfill_metadata()
+
+    first_page = db_client.get('/api/get_results?limit=2')
+    assert [r['sessionId'] for r in first_page.get_json()] == ['s2', 's1']
+
+    cursor = first_page.headers['X-Next-Cursor']
+    second_page = db_client.get('/api/get_results', query_string={'limit': 2, 'cursor': cursor})
+    assert [r['sessionId'] for r in second_page.get_json()] == ['s0']
+    assert 'X-Next-Cursor' not in second_page.headers
+
+def test_document_numbers_are_reserved_in_blocks(db_client):
+    """
+    Тест для проверки, что номера документов выдаются подряд из одного
+    зарезервированного блока.
+    """
+    first = app_module.get_next_document_number()
+    second = app_module.get_next_document_number()
+    period, first_sequence = first.rsplit('-', 1)
+    assert second == f"{period}-{int(first_sequence) + 1:04d}"
+
+    with app_module.get_db_writer() as conn:
+        row = conn.execute(
+            "SELECT last_sequence_number FROM document_counters WHERE period = ?", (period,)
+        ).fetchone()
+    assert row['last_sequence_number'] == app_module.DOCUMENT_NUMBER_BLOCK_SIZE
+
+def test_abandoned_sessions_exclude_completed(db_client):
+    """
+    Тест для проверки, что завершенные сессии не попадают в список прерванных,
+    а у прерванных подсчитываются нарушения и извлекаются данные пользователя.
+    """
+    events = [
+        ('done', 'test_started', '2024-01-01T09:00:00.000Z', {'userInfo': {'lastName': 'Петров'}}),
+        ('left', 'test_started', '2024-01-01T10:00:00.000Z', {'userInfo': {'lastName': 'Сидоров'}}),
+        ('left', 'focus_loss', '2024-01-01T10:01:00.000Z', {}),
+        ('left', 'focus_loss', '2024-01-01T10:02:00.000Z', {}),
+        ('study', 'study_started', '2024-01-01T11:00:00.000Z', {'persistentId': 'abcdef1234'}),
+    ]
+    for session_id, event_type, timestamp, details in events:
+        db_client.post('/api/log_event', json={
+            'sessionId': session_id, 'eventType': event_type,
+            'eventTimestamp': timestamp, 'details': details,
+        })
+    db_client.post('/api/save_results', json={
+        'sessionId': 'done', 'userInfo': {'lastName': 'Петров'}, 'testResults': {'percentage': 10},
+    })
+    app_module.flush_event_buffer()
+
+    sessions = db_client.get('/api/get_abandoned_sessions').get_json()
+    assert [s['sessionId'] for s in sessions] == ['study', 'left']
+    assert sessions[0]['sessionType'] == 'study'
+    assert sessions[0]['userInfo']['firstName'] == 'ID: abcdef12...'
+    assert sessions[1]['userInfo'] == {'lastName': 'Сидоров'}
+    assert sessions[1]['clientIp'] == '127.0.0.1'
+    assert sessions[1]['violationCounts'] == {'focusLoss': 2, 'screenshots': 0, 'prints': 0}
+
+    # События завершенной сессии, записанные после результата, удаляются
+    # из open_sessions при следующей инициализации БД
+    app_module.init_db()
+    with app_module.get_db_writer('ev') as conn:
+        open_sessions = {row[0] for row in conn.execute("SELECT session_id FROM ev.open_sessions")}
+    assert open_sessions == {'left', 'study'}
+
+def test_event_hot_fields_are_denormalized(db_client):
+    """
+    Тест для проверки, что длительность просмотра модуля и глубина прокрутки
+    сохраняются в отдельных столбцах proctoring_events.
+    """
+    events = [
+        ('module_view_time', {'page': 'study.html', 'module': 'm1', 'duration': 90}),
+        ('module_view_time', {'page': 'study.html', 'module': 'm2', 'duration': 30.5}),
+        ('module_view_time', {'page': 'study.html', 'module': 'm3', 'duration': '15'}),
+        ('scroll_depth_milestone', {'page': 'study.html', 'depth': '75%'}),
+        ('scroll_depth_milestone', {'page': 'study.html', 'depth': '²'}),
+        ('scroll_depth_milestone', {'page': 'study.html', 'depth': '9' * 30}),
+    ]
+    for event_type, details in events:
+        db_client.post('/api/log_event', json={
+            'sessionId': 'study-1', 'eventType': event_type,
+            'eventTimestamp': '2024-01-01T10:00:00.000Z', 'details': details,
+        })
+    app_module.flush_event_buffer()
+
+    with app_module.get_db_writer('ev') as conn:
+        row = conn.execute("""
+            SELECT SUM(duration_sec) AS duration, MAX(scroll_depth_pct) AS depth
+            FROM proctoring_events WHERE session_id = 'study-1'
+        """).fetchone()
+    assert row['duration'] == 120.5
+    assert row['depth'] == 75
+    assert app_module.build_event_row('s', 'module_view_time', 't', {'duration': float('inf')})[4] is None
+
+def test_engagement_score_is_aggregated(db_client):
+    """
+    Тест для проверки расчета индекса вовлеченности по событиям учебной сессии.
+    """
+    events = [
+        ('study_started', '2024-01-01T10:00:00.000Z', {}),
+        ('module_view_time', '2024-01-01T10:02:00.000Z', {'duration': 125}),
+        ('scroll_depth_milestone', '2024-01-01T10:03:00.000Z', {'depth': '50%'}),
+        ('self_check_answered', '2024-01-01T10:04:00.000Z', {}),
+        ('self_check_answered', '2024-01-01T10:05:00.000Z', {}),
+    ]
+    for event_type, timestamp, details in events:
+        db_client.post('/api/log_event', json={
+            'sessionId': 'study-2', 'eventType': event_type,
+            'eventTimestamp': timestamp, 'details': details,
+        })
+    app_module.flush_event_buffer()
+
+    with app_module.app.app_context():
+        assert app_module.calculate_engagement_scores(['study-2', 'missing']) == {
+            'study-2': (2 + 5 + 4, 300)
+        }
+
+    db_client.post('/api/log_event', json={
+        'sessionId': 'study-2', 'eventType': 'self_check_answered',
+        'eventTimestamp': '2024-01-01T10:06:00.000Z',
+    })
+    app_module.flush_event_buffer()
+
+    with app_module.app.app_context():
+        assert app_module.calculate_engagement_scores(['study-2']) == {'study-2': (2 + 5 + 6, 360)}
+
+def test_passing_result_saves_certificate(db_client):
+    """
+    Тест для проверки, что при успешной сдаче сертификат и метаданные
+    результата сохраняются вместе.
+    """
+    response = db_client.post('/api/save_results', json={
+        'sessionId': 'passed', 'testType': 'ib',
+        'userInfo': {'lastName': 'Иванов', 'firstName': 'Иван', 'position': 'Инженер'},
+        'testResults': {'percentage': 90},
+    })
+    assert response.status_code == 201
+    document_number = response.get_json()['officialDocumentNumber']
+
+    certificates = db_client.get('/api/get_certificates').get_json()
+    assert [c['document_number'] for c in certificates] == [document_number]
+    assert certificates[0]['user_fullname'] == 'Иванов Иван'
+    assert [r['sessionId'] for r in db_client.get('/api/get_results').get_json()] == ['passed']
+
+def test_init_db_moves_legacy_events(app, tmp_path, monkeypatch):
+    """
+    Тест для проверки переноса событий из app_data.db в events.db.
+    """
+    database_path = tmp_path / "app_data.db"
+    monkeypatch.setattr(app_module, "DATABASE_PATH", str(database_path))
+    monkeypatch.setattr(app_module, "EVENTS_DATABASE_PATH", str(tmp_path / "events.db"))
+    monkeypatch.setattr(app_module, "RESULTS_DIR", str(tmp_path))
+    app_module.close_db_connections()
+
+    legacy = sqlite3.connect(database_path)
+    legacy.execute("""
+        CREATE TABLE proctoring_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,
+            event_type TEXT NOT NULL, event_timestamp TEXT NOT NULL, details TEXT
+        )
+    """)
+    legacy.execute(
+        "INSERT INTO proctoring_events (session_id, event_type, event_timestamp, details) VALUES (?, ?, ?, ?)",
+        ('old', 'module_view_time', '2024-01-01T10:00:00.000Z', json.dumps({'duration': 42})),
+    )
+    legacy.executemany(
+        "INSERT INTO proctoring_events (session_id, event_type, event_timestamp, details) VALUES (?, ?, ?, ?)",
+        [('old', 'module_view_time', '2024-01-01T10:00:01.000Z', json.dumps({'duration': 'long'})),
+         ('old', 'scroll_depth_milestone', '2024-01-01T10:00:02.000Z', json.dumps({'depth': 'full'})),
+         ('old', 'scroll_depth_milestone', '2024-01-01T10:00:03.000Z', json.dumps({'depth': '50%'}))],
+    )
+    legacy.commit()
+    legacy.close()
+
+    try:
+        app_module.init_db()
+        with app_module.get_db_writer('ev') as conn:
+            assert conn.execute(
+                "SELECT 1 FROM main.sqlite_master WHERE name = 'proctoring_events'"
+            ).fetchone() is None
+            rows = conn.execute(
+                "SELECT session_id, duration_sec, scroll_depth_pct FROM ev.proctoring_events ORDER BY id"
+            ).fetchall()
+        assert [tuple(row) for row in rows] == [
+            ('old', 42, None), ('old', None, None), ('old', None, None), ('old', None, 50),
+        ]
+    finally:
+        app_module.close_db_connections()
+
+def test_create_result_file_does_not_overwrite(db_client):
+    """
+    Тест для проверки, что файл результата с уже занятым именем
+    сохраняется под новым именем.
+    """
+    first = app_module.create_result_file('result_Petrov.json', b'{"n": 1}')
+    second = app_module.create_result_file('result_Petrov.json', b'{"n": 2}')
+    assert (first, second) == ('result_Petrov.json', 'result_Petrov_1.json')
+    assert app_module.load_result_file(second) == {'n': 2}
+    assert app_module.sanitize_filename('Иванов-Петров Иван') == 'Ivanov-Petrov_Ivan'
+
+def test_find_related_study_session_time_window(db_client):
+    """
+    Тест для проверки поиска учебной сессии по persistent ID и по IP
+    в пределах MAX_STUDY_SESSION_LOOKUP_HOURS до начала теста.
+    """
+    db_client.post('/api/log_event', json={
+        'sessionId': 'study-3', 'eventType': 'study_started',
+        'eventTimestamp': '2024-01-01T10:00:00.000Z',
+        'details': {'page': 'study.html', 'persistentId': 'pid-1'},
+    })
+    app_module.flush_event_buffer()
+
+    find = app_module.find_related_study_session
+    with app_module.app.app_context():
+        assert find('2024-01-01T11:00:00.000Z', 'pid-1', None, 'study.html') == 'study-3'
+        assert find('2024-01-01T11:00:00.000Z', None, '127.0.0.1', 'study.html') == 'study-3'
+        assert find('2024-01-03T11:00:00.000Z', None, '127.0.0.1', 'study.html') is None
+        assert find('2024-01-01T09:00:00.000Z', 'pid-1', None, 'study.html') is None
+        assert find('2024-01-02T11:00:00.000Z', 'pid-2', None, 'study.html') is None
+        assert find('2024-01-02T11:00:00.000Z', 'pid-2', None, 'other.html') is None
+
+    # Новая учебная сессия меняет версию кэша поиска только для своего
+    # пользователя и страницы
+    cached_keys = set(app_module._memo_cache)
+    db_client.post('/api/log_event', json={
+        'sessionId': 'study-4', 'eventType': 'study_started',
+        'eventTimestamp': '2024-01-02T10:00:00.000Z',
+        'details': {'page': 'study.html', 'persistentId': 'pid-2'},
+    })
+    app_module.flush_event_buffer()
+    with app_module.app.app_context():
+        assert find('2024-01-01T11:00:00.000Z', 'pid-1', None, 'study.html') == 'study-3'
+        assert set(app_module._memo_cache) == cached_keys
+        assert find('2024-01-02T11:00:00.000Z', 'pid-2', None, 'study.html') == 'study-4'
+
+def test_find_related_study_session_sees_new_study_after_cached_miss(db_client):
+    """
+    Тест для проверки, что закэшированное отсутствие учебной сессии не скрывает
+    сессию, записанную позже другим процессом (без сброса кэша в этом).
+    """
+    find = app_module.find_related_study_session
+    with app_module.app.app_context():
+        assert find('2024-01-01T11:00:00.000Z', 'pid-5', None, 'study.html') is None
+
+    with app_module.get_db_writer('ev') as conn:
+        conn.execute(app_module.INSERT_EVENT_SQL, app_module.build_event_row(
+            'study-5', 'study_started', '2024-01-01T10:00:00.000Z',
+            {'page': 'study.html', 'persistentId': 'pid-5'},
+        ))
+
+    with app_module.app.app_context():
+        assert find('2024-01-01T11:00:00.000Z', 'pid-5', None, 'study.html') == 'study-5'
+
+def test_log_event_rejects_malformed_payload(db_client):
+    """
+    Тест для проверки, что событие неверной формы отклоняется с кодом 400.
+    """
+    for payload in ([], {'sessionId': 's'}, {'sessionId': 1, 'eventType': 'x'},
+                    {'sessionId': 's', 'eventType': 'x', 'details': ['ip']},
+                    {'sessionId': 's', 'eventType': 'x', 'eventTimestamp': {'ts': 1}}):
+        assert db_client.post('/api/log_event', json=payload).status_code == 400
+    response = db_client.post('/api/log_event', data=b'{"sessionId": ', content_type='application/json')
+    assert response.status_code == 400
+
+def test_behavior_analysis_flags_fast_tests_without_study(db_client):
+    """
+    Тест для проверки, что быстрый тест с высоким баллом без учебной
+    сессии попадает в список подозрительных, а медленный - нет.
+    """
+    for session_id, end_time in (('fast', '2024-01-01T10:01:00.000Z'), ('slow', '2024-01-01T10:30:00.000Z')):
+        response = db_client.post('/api/save_results', json={
+            'sessionId': session_id, 'testType': 'INFOSEC_117',
+            'userInfo': {'lastName': session_id}, 'testResults': {'percentage': 95},
+            'persistentId': {'cookie': f'pid-{session_id}'},
+            'sessionMetrics': {'startTime': '2024-01-01T10:00:00.000Z', 'endTime': end_time},
+        })
+        assert response.status_code == 201
+
+    sessions = db_client.get('/api/get_behavior_analysis').get_json()
+    assert [s['sessionId'] for s in sessions] == ['fast']
+    assert sessions[0]['userInfo'] == {'lastName': 'fast'}
+    assert sessions[0]['testResult'] == {'score': 95, 'duration': 60}
+    assert sessions[0]['studyInfo'] == {'duration': 0, 'engagementScore': 0}
+
+def test_abandoned_sessions_etag(db_client):
+    """
+    Тест для проверки, что повторный запрос с ETag получает 304,
+    а после закрытия сессии список пересчитывается.
+    """
+    db_client.post('/api/log_event', json={
+        'sessionId': 's1', 'eventType': 'test_started',
+        'eventTimestamp': '2024-01-01T09:00:00.000Z', 'details': {'userInfo': {'lastName': 'Иванов'}},
+    })
+    app_module.flush_event_buffer()
+
+    response = db_client.get('/api/get_abandoned_sessions')
+    assert [s['sessionId'] for s in response.get_json()] == ['s1']
+    etag = response.headers['ETag']
+    assert db_client.get('/api/get_abandoned_sessions', headers={'If-None-Match': etag}).status_code == 304
+
+    db_client.post('/api/save_results', json={
+        'sessionId': 's1', 'userInfo': {'lastName': 'Иванов'}, 'testResults': {'percentage': 10},
+    })
+    response = db_client.get('/api/get_abandoned_sessions', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json() == []
+
+def test_log_event_rejects_oversized_body(db_client):
+    """
+    Тест для проверки, что слишком большое событие отклоняется до разбора JSON.
+    """
+    response = db_client.post(
+        '/api/log_event', data=b'x' * (app_module.MAX_LOG_EVENT_SIZE + 1),
+        content_type='application/json',
+    )
+    assert response.status_code == 413
+    assert response.get_json()['status'] == 'error'
+
+    # Тело без Content-Length (chunked) проверяется при чтении
+    for url, size in (('/api/log_event', app_module.MAX_LOG_EVENT_SIZE + 1),
+                      ('/api/save_results', app_module.MAX_SAVE_RESULTS_SIZE + 1)):
+        response = db_client.post(
+            url, input_stream=io.BytesIO(b'x' * size), content_type='application/json',
+            headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True},
+        )
+        assert response.status_code == 413
+
+def test_save_results_keeps_files_in_sync_with_metadata(db_client, monkeypatch):
+    """
+    Тест для проверки, что результат с полями неверного типа отклоняется,
+    а при ошибке записи в БД файл результата не остается на диске.
+    """
+    payload = {'userInfo': {'lastName': 'Иванов'}, 'testResults': {'percentage': 10}}
+    for invalid in ({'sessionId': {'id': 1}}, {'testType': ['x']},
+                    {'testResults': {'percentage': '10'}}, {'testResults': {'percentage': 400}},
+                    {'testResults': {'percentage': -1}}):
+        response = db_client.post('/api/save_results', json={**payload, 'sessionId': 's', **invalid})
+        assert response.status_code == 400
+    assert os.listdir(app_module.RESULTS_DIR) == []
+
+    def failing_save(*args):
+        raise ValueError('unexpected')
+
+    for save in (lambda *args: False, failing_save):
+        monkeypatch.setattr(app_module, 'save_result_to_db', save)
+        response = db_client.post('/api/save_results', json={**payload, 'sessionId': 's'})
+        assert response.status_code == 500
+        assert os.listdir(app_module.RESULTS_DIR) == []
+
+def test_naive_event_timestamps_are_normalized_to_utc(db_client):
+    """
+    Тест для проверки, что события с локальным временем сервера без часового
+    пояса переводятся в UTC и сравниваются с событиями в UTC по одной шкале.
+    """
+    old_tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'Europe/Moscow'  # UTC+3 без перехода на летнее время
+    time.tzset()
+    try:
+        with app_module.get_db_writer('ev') as conn:
+            for session_id, timestamp, persistent_id in (
+                ('study-local', '2024-01-01T12:00:00', 'pid-local'),
+                ('study-utc', '2024-01-01T09:10:00.000Z', 'pid-utc'),
+            ):
+                conn.execute(app_module.INSERT_EVENT_SQL, app_module.build_event_row(
+                    session_id, 'study_started', timestamp,
+                    {'page': 'study.html', 'persistentId': persistent_id},
+                ))
+            conn.execute("PRAGMA ev.user_version = 0")
+        app_module.init_db()
+    finally:
+        if old_tz is None:
+            os.environ.pop('TZ')
+        else:
+            os.environ['TZ'] = old_tz
+        time.tzset()
+
+    with app_module.get_db_writer('ev') as conn:
+        timestamps = dict(conn.execute("SELECT session_id, event_timestamp FROM ev.proctoring_events"))
+    assert timestamps == {'study-local': '2024-01-01T09:00:00+00:00', 'study-utc': '2024-01-01T09:10:00.000Z'}
+
+    find = app_module.find_related_study_session
+    with app_module.app.app_context():
+        assert find('2024-01-01T09:30:00.000Z', 'pid-local', None, 'study.html') == 'study-local'
+        assert find('2024-01-01T09:30:00.000Z', 'pid-utc', None, 'study.html') == 'study-utc'
+
+def test_flush_event_buffer_drops_only_unwritable_events(db_client):
+    """
+    Тест для проверки, что событие, которое невозможно записать, отбрасывается,
+    не блокируя буфер и не приводя к потере остальных событий пакета.
+    """
+    good_row = app_module.build_event_row('session-ok', 'test_started', '2024-01-01T10:00:00.000Z', {})
+    app_module.enqueue_event(good_row)
+    app_module.enqueue_event(('session-bad', 'focus_loss', {'ts': 1}, '{}', None, None))
+    app_module.enqueue_event(('session-bad', 'module_view_time', '2024-01-01T10:00:01.000Z',
+                              '{}', 18446744073709551615, None))
+    app_module.enqueue_event(app_module.build_event_row('session-ok', 'focus_loss', '2024-01-01T10:00:02.000Z', {}))
+
+    app_module.flush_event_buffer()
+    assert app_module._event_buffer == []
+
+    events = db_client.get('/api/get_events/session-ok').get_json()
+    assert [event['event_type'] for event in events] == ['test_started', 'focus_loss']
+    assert db_client.get('/api/get_events/session-bad').get_json() == []